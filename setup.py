@@ -18,7 +18,7 @@
 from distutils.core import setup
 from distutils.core import Command
 
-from subprocess import call
+from subprocess import call, Popen, PIPE
 from os import getcwd
 import sys
 
@@ -51,6 +51,35 @@ class Pep8Command(Command):
         retcode = call(('pep8 %s/vmlauncher/ %s/tests/' % (cwd, cwd)).split(' '))
         sys.exit(retcode)
 
+class ImportTimeCommand(Command):
+    description = "benchmark the time taken to import vmlauncher"
+    user_options = [('runs=', 'r', 'number of fresh interpreters to time')]
+
+    def initialize_options(self):
+        self.runs = 10
+
+    def finalize_options(self):
+        self.runs = int(self.runs)
+
+    def run(self):
+        script = ('import sys, time; start = time.time(); import vmlauncher; '
+                  'elapsed = time.time() - start; '
+                  'heavy = [m for m in ("libcloud", "fabric", "boto") if m in sys.modules]; '
+                  'print("%f %s" % (elapsed, ",".join(heavy)))')
+        timings = []
+        heavy = set()
+        for _ in range(self.runs):
+            output = Popen([sys.executable, '-c', script], cwd=getcwd(), stdout=PIPE).communicate()[0]
+            elapsed, _, loaded = output.decode().strip().partition(' ')
+            timings.append(float(elapsed))
+            heavy.update(module for module in loaded.split(',') if module)
+        timings.sort()
+        print('vmlauncher import time over %d runs: min %.1fms, median %.1fms, max %.1fms' %
+              (self.runs, timings[0] * 1000, timings[len(timings) // 2] * 1000, timings[-1] * 1000))
+        if heavy:
+            print('Importing vmlauncher eagerly loaded: %s' % ', '.join(sorted(heavy)))
+            sys.exit(1)
+
 setup(
     name='vm-launcher',
     version='0.1',
@@ -67,6 +96,7 @@ setup(
     url='https://github.com/jmchilton/vm-launcher/',
     cmdclass={
         'pep8': Pep8Command,
+        'import_time': ImportTimeCommand,
    },
     classifiers=[
         'Development Status :: 4 - Beta',
@@ -0,0 +1,48 @@
+"""
+Shared test helpers. The transfer code is exercised with LocalTransport,
+which only needs fabric's local, so if fabric is not installed a minimal
+stand-in providing local (and failing loudly for remote operations) is used.
+"""
+import sys
+import types
+import subprocess
+
+
+def ensure_fabric():
+    try:
+        import fabric.api
+        import fabric.colors
+    except ImportError:
+        _install_fabric_stub()
+
+
+class _LocalResult(str):
+    failed = False
+    succeeded = True
+
+
+def _local(command, capture=False):
+    if capture:
+        return _LocalResult(subprocess.check_output(command, shell=True))
+    subprocess.check_call(command, shell=True)
+
+
+def _remote(*args, **kwds):
+    raise Exception("Remote fabric operations are not available in tests.")
+
+
+def _install_fabric_stub():
+    fabric = types.ModuleType("fabric")
+    api = types.ModuleType("fabric.api")
+    api.local = _local
+    api.put = _remote
+    api.sudo = _remote
+    api.run = _remote
+    api.cd = _remote
+    colors = types.ModuleType("fabric.colors")
+    colors.red = lambda text: text
+    fabric.api = api
+    fabric.colors = colors
+    sys.modules["fabric"] = fabric
+    sys.modules["fabric.api"] = api
+    sys.modules["fabric.colors"] = colors
@@ -0,0 +1,87 @@
+import os
+import time
+import shutil
+import tempfile
+import unittest
+
+from threading import Thread
+
+from vmlauncher.bandwidth import BandwidthLimiter, ThrottledFile, HIGH_PRIORITY, NORMAL_PRIORITY, LOW_PRIORITY
+
+
+class BandwidthLimiterTest(unittest.TestCase):
+
+    def test_priority_order(self):
+        limiter = BandwidthLimiter(rate=1000000)
+        # Put the bucket into debt so every later request has to queue.
+        limiter.acquire(200000)
+        granted = []
+
+        def request(name, priority):
+            limiter.acquire(100000, priority)
+            granted.append(name)
+
+        threads = []
+        for name, priority in [("low", LOW_PRIORITY), ("normal", NORMAL_PRIORITY), ("high", HIGH_PRIORITY)]:
+            thread = Thread(target=request, args=(name, priority))
+            thread.start()
+            threads.append(thread)
+            time.sleep(0.02)
+        for thread in threads:
+            thread.join()
+        self.assertEquals(["high", "normal", "low"], granted)
+
+    def test_rate_is_enforced(self):
+        limiter = BandwidthLimiter(rate=1000000)
+        start = time.time()
+        for i in range(5):
+            limiter.acquire(100000)
+        self.assertTrue(time.time() - start >= 0.35)
+
+    def test_unlimited(self):
+        limiter = BandwidthLimiter()
+        start = time.time()
+        for i in range(100):
+            limiter.acquire(10000000)
+        self.assertTrue(time.time() - start < 0.5)
+
+    def test_set_rate_applies_to_waiting_requests(self):
+        limiter = BandwidthLimiter(rate=1000)
+        limiter.acquire(100000)
+        Thread(target=limiter.set_rate, args=(None,)).start()
+        start = time.time()
+        limiter.acquire(100000)
+        self.assertTrue(time.time() - start < 0.5)
+
+
+class RecordingLimiter:
+
+    def __init__(self):
+        self.requests = []
+
+    def acquire(self, num_bytes, priority=NORMAL_PRIORITY):
+        self.requests.append((num_bytes, priority))
+
+
+class ThrottledFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, "file")
+        self.contents = os.urandom(10000)
+        open(self.path, "wb").write(self.contents)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_reads_draw_from_limiter(self):
+        limiter = RecordingLimiter()
+        throttled = ThrottledFile(self.path, HIGH_PRIORITY, limiter)
+        data = "".join(iter(lambda: throttled.read(4096), ""))
+        throttled.close()
+        self.assertTrue(self.contents == data)
+        self.assertEquals([(4096, HIGH_PRIORITY), (4096, HIGH_PRIORITY), (1808, HIGH_PRIORITY)], limiter.requests)
+
+
+if __name__ == "__main__":
+    unittest.main()
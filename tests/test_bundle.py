@@ -0,0 +1,137 @@
+import hashlib
+import threading
+import unittest
+
+from tests.helpers import ensure_fabric
+ensure_fabric()
+
+import fabric.api
+
+from vmlauncher import BundleUploader
+
+BUNDLE_DIR = "/mnt/packaging/bundle"
+
+
+class FakeResult(str):
+
+    def __init__(self, value=""):
+        self.failed = False
+
+    @property
+    def succeeded(self):
+        return not self.failed
+
+
+class FakeKey:
+
+    def __init__(self, content):
+        self.etag = '"%s"' % hashlib.md5(content).hexdigest()
+        self.size = len(content)
+
+
+class FakeBucket:
+    name = "bucket"
+
+    def __init__(self):
+        self.keys = {}
+
+    def get_key(self, name):
+        return self.keys.get(name)
+
+
+class FakeS3Connection:
+
+    def generate_url(self, expires, method, bucket=None, key=None, headers=None):
+        return "https://s3/%s/%s" % (bucket, key)
+
+
+class FakeInstance:
+    """
+    Stands in for fabric's sudo on the instance being bundled, serving
+    md5sum from files and applying curl PUTs to a FakeBucket.
+    """
+
+    def __init__(self, files, bucket, failing_puts=0):
+        self.files = files
+        self.bucket = bucket
+        self.failing_puts = failing_puts
+        self.puts = []
+        self.lock = threading.Lock()
+
+    def sudo(self, command, warn_only=False):
+        if command.startswith("md5sum "):
+            path = command.split()[1]
+            content = self.files[path.rsplit("/", 1)[1]]
+            return FakeResult("%s  %s" % (hashlib.md5(content).hexdigest(), path))
+        if command.startswith("curl "):
+            part = command.rsplit("/", 1)[1].rstrip("'")
+            self.lock.acquire()
+            try:
+                self.puts.append(part)
+                failed = self.failing_puts > 0
+                if failed:
+                    self.failing_puts -= 1
+            finally:
+                self.lock.release()
+            result = FakeResult()
+            if failed:
+                result.failed = True
+            else:
+                self.bucket.keys[part] = FakeKey(self.files[part])
+            return result
+        raise Exception("Unexpected command %s" % command)
+
+
+class BundleUploaderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.files = {"image.part.00": "part zero",
+                      "image.part.01": "part one",
+                      "image.manifest.xml": "manifest"}
+        self.bucket = FakeBucket()
+        self.original_sudo = fabric.api.sudo
+
+    def tearDown(self):
+        fabric.api.sudo = self.original_sudo
+
+    def _uploader(self, failing_puts=0, retries=3):
+        self.instance = FakeInstance(self.files, self.bucket, failing_puts)
+        fabric.api.sudo = self.instance.sudo
+        return BundleUploader(FakeS3Connection(), self.bucket, BUNDLE_DIR, num_threads=2, retries=retries)
+
+    def test_upload(self):
+        threads_before = threading.active_count()
+        self._uploader().upload(["image.part.00", "image.part.01"])
+        self.assertEquals(["image.part.00", "image.part.01"], sorted(self.instance.puts))
+        self.assertEquals(threads_before, threading.active_count())
+
+    def test_resume_skips_matching_parts(self):
+        self.bucket.keys["image.part.00"] = FakeKey("part zero")
+        self._uploader().upload(["image.part.00", "image.part.01"])
+        self.assertEquals(["image.part.01"], self.instance.puts)
+
+    def test_resume_replaces_parts_from_other_bundles(self):
+        # Same key and size, different content.
+        self.bucket.keys["image.part.00"] = FakeKey("part ZERO")
+        self._uploader().upload(["image.part.00", "image.part.01"])
+        self.assertEquals(["image.part.00", "image.part.01"], sorted(self.instance.puts))
+        self.assertEquals(FakeKey("part zero").etag, self.bucket.keys["image.part.00"].etag)
+
+    def test_manifest_never_skipped(self):
+        self.bucket.keys["image.manifest.xml"] = FakeKey("manifest")
+        self._uploader().upload(["image.manifest.xml"], resume=False)
+        self.assertEquals(["image.manifest.xml"], self.instance.puts)
+
+    def test_failed_puts_are_retried(self):
+        self._uploader(failing_puts=2).upload(["image.part.00"])
+        self.assertEquals(["image.part.00"] * 3, self.instance.puts)
+        self.assertTrue("image.part.00" in self.bucket.keys)
+
+    def test_exhausted_retries_raise(self):
+        uploader = self._uploader(failing_puts=3)
+        self.assertRaises(Exception, uploader.upload, ["image.part.00"])
+        self.assertEquals(["image.part.00"] * 3, self.instance.puts)
+
+
+if __name__ == "__main__":
+    unittest.main()
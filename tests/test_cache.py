@@ -0,0 +1,49 @@
+import os
+import stat
+import time
+import shutil
+import tempfile
+import unittest
+
+from vmlauncher.cache import TokenStore, TOKEN_EXPIRY_MARGIN
+
+IDENTITY = ["user", "password-digest", {"ex_tenant_name": "tenant"}]
+
+
+class TokenStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, "tokens", "auth_tokens.json")
+        self.store = TokenStore(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_round_trip(self):
+        self.store.put("openstack", IDENTITY, "token", time.time() + 3600, "http://nova")
+        entry = TokenStore(self.path).get("openstack", IDENTITY)
+        self.assertEquals("token", entry["token"])
+        self.assertEquals("http://nova", entry["base_url"])
+
+    def test_expired_tokens_ignored(self):
+        self.store.put("openstack", IDENTITY, "token", time.time() + TOKEN_EXPIRY_MARGIN - 1, "http://nova")
+        self.assertEquals(None, self.store.get("openstack", IDENTITY))
+
+    def test_changed_identity_ignored(self):
+        self.store.put("openstack", IDENTITY, "token", time.time() + 3600, "http://nova")
+        self.assertEquals(None, self.store.get("openstack", ["user", "other-digest", {}]))
+
+    def test_remove(self):
+        self.store.put("openstack", IDENTITY, "token", time.time() + 3600, "http://nova")
+        self.store.remove("openstack")
+        self.assertEquals(None, self.store.get("openstack", IDENTITY))
+
+    def test_permissions(self):
+        self.store.put("openstack", IDENTITY, "token", time.time() + 3600, "http://nova")
+        self.assertEquals(0600, stat.S_IMODE(os.stat(self.path).st_mode))
+        self.assertEquals(0700, stat.S_IMODE(os.stat(os.path.dirname(self.path)).st_mode))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,189 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from tests.helpers import ensure_fabric
+ensure_fabric()
+
+import vmlauncher
+from vmlauncher import Ec2VmLauncher, OpenstackVmLauncher, FINGERPRINT_TAG
+
+
+class FakeImage:
+
+    def __init__(self, id, state="available", status="ACTIVE", metadata=None):
+        self.id = id
+        self.state = state
+        self.extra = {"status": status, "metadata": metadata or {}}
+
+
+class FakeOpenstackDriver:
+
+    def __init__(self, images):
+        self.images = images
+        self.saved = []
+
+    def list_images(self):
+        return self.images
+
+    def ex_save_image(self, node, name, metadata=None):
+        self.saved.append((name, metadata))
+        return FakeImage("saved-image")
+
+
+class FakeEc2Connection:
+
+    def __init__(self, images):
+        self.images = images
+        self.tags = []
+
+    def get_all_images(self, owners=None, filters=None):
+        fingerprint = filters["tag:%s" % FINGERPRINT_TAG]
+        return [image for image in self.images if image.extra["metadata"].get(FINGERPRINT_TAG) == fingerprint]
+
+    def create_tags(self, resource_ids, tags):
+        self.tags.append((resource_ids, tags))
+
+
+class FingerprintTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.key_file = self._write("key", "key")
+        self.original_sleep = vmlauncher.time.sleep
+        vmlauncher.time.sleep = lambda seconds: None
+
+    def tearDown(self):
+        vmlauncher.time.sleep = self.original_sleep
+        shutil.rmtree(self.temp_dir)
+
+    def _write(self, relative_path, contents):
+        path = os.path.join(self.temp_dir, relative_path)
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        open(path, "w").write(contents)
+        return path
+
+    def _checkout(self, location, setup_contents="setup"):
+        self._write("%s/scripts/setup.sh" % location, setup_contents)
+        self._write("%s/scripts/lib/common.sh" % location, "common")
+        self._write("%s/galaxy.tar" % location, "galaxy")
+        return [os.path.join(self.temp_dir, location, "scripts"),
+                os.path.join(self.temp_dir, location, "galaxy.tar")]
+
+    def _launcher(self, launcher_class, **driver_options):
+        driver_options.setdefault("image_id", "base-image")
+        driver_options["key_file"] = self.key_file
+        return launcher_class("provider", {"provider": driver_options})
+
+
+class PackageFingerprintTest(FingerprintTestCase):
+
+    def test_stable_across_checkout_locations(self):
+        first = self._launcher(OpenstackVmLauncher, package_fingerprint_files=self._checkout("first"))
+        second = self._launcher(OpenstackVmLauncher, package_fingerprint_files=self._checkout("second/nested"))
+        self.assertEquals(first.package_fingerprint(), second.package_fingerprint())
+        self.assertEquals(["file:galaxy.tar", "file:scripts/lib/common.sh", "file:scripts/setup.sh"],
+                          sorted(first.fingerprint_inputs))
+
+    def test_independent_of_order(self):
+        files = self._checkout("checkout")
+        first = self._launcher(OpenstackVmLauncher, package_fingerprint_files=files)
+        first.add_fingerprint_input("a", "1")
+        first.add_fingerprint_input("b", "2")
+        second = self._launcher(OpenstackVmLauncher, package_fingerprint_files=list(reversed(files)))
+        second.add_fingerprint_input("b", "2")
+        second.add_fingerprint_input("a", "1")
+        self.assertEquals(first.package_fingerprint(), second.package_fingerprint())
+        # Repeated calls do not change it either.
+        self.assertEquals(first.package_fingerprint(), first.package_fingerprint())
+
+    def test_changes_with_inputs(self):
+        fingerprint = self._launcher(OpenstackVmLauncher, package_fingerprint_files=self._checkout("a")).package_fingerprint()
+        changed_file = self._launcher(OpenstackVmLauncher, package_fingerprint_files=self._checkout("b", "changed"))
+        self.assertNotEquals(fingerprint, changed_file.package_fingerprint())
+        changed_image = self._launcher(OpenstackVmLauncher, image_id="other-image",
+                                       package_fingerprint_files=self._checkout("c"))
+        self.assertNotEquals(fingerprint, changed_image.package_fingerprint())
+        added_input = self._launcher(OpenstackVmLauncher, package_fingerprint_files=self._checkout("d"))
+        added_input.add_fingerprint_input("extra", "value")
+        self.assertNotEquals(fingerprint, added_input.package_fingerprint())
+
+    def test_conflicting_keys_rejected(self):
+        self._checkout("first")
+        self._checkout("second")
+        launcher = self._launcher(OpenstackVmLauncher,
+                                  package_fingerprint_files=[os.path.join(self.temp_dir, "first", "scripts"),
+                                                             os.path.join(self.temp_dir, "second", "scripts")])
+        self.assertRaises(Exception, launcher.package_fingerprint)
+
+
+class OpenstackPackageTest(FingerprintTestCase):
+
+    def setUp(self):
+        FingerprintTestCase.setUp(self)
+        self.launcher = self._launcher(OpenstackVmLauncher,
+                                       package_image_name="image",
+                                       package_fingerprint=True,
+                                       package_fingerprint_files=self._checkout("checkout"))
+        self.fingerprint = self.launcher.package_fingerprint()
+        self.launcher.node = object()
+
+    def test_hit(self):
+        self.launcher.conn = FakeOpenstackDriver([FakeImage("other", metadata={FINGERPRINT_TAG: "other"}),
+                                                  FakeImage("match", metadata={FINGERPRINT_TAG: self.fingerprint})])
+        self.assertEquals("match", self.launcher.package(name="image"))
+        self.assertEquals([], self.launcher.conn.saved)
+
+    def test_miss(self):
+        self.launcher.conn = FakeOpenstackDriver([FakeImage("other", metadata={FINGERPRINT_TAG: "other"})])
+        self.assertEquals("saved-image", self.launcher.package(name="image"))
+        self.assertEquals([("image", {FINGERPRINT_TAG: self.fingerprint})], self.launcher.conn.saved)
+
+    def test_unusable_images_ignored(self):
+        self.launcher.conn = FakeOpenstackDriver([FakeImage("saving", status="SAVING",
+                                                            metadata={FINGERPRINT_TAG: self.fingerprint})])
+        self.assertEquals("saved-image", self.launcher.package(name="image"))
+
+
+class Ec2PackageTest(FingerprintTestCase):
+
+    def setUp(self):
+        FingerprintTestCase.setUp(self)
+        self.launcher = self._launcher(Ec2VmLauncher,
+                                       package_type="create_image",
+                                       package_fingerprint=True,
+                                       package_fingerprint_files=self._checkout("checkout"))
+        self.fingerprint = self.launcher.package_fingerprint()
+        self.created = []
+        self.launcher._create_image = self._create_image
+
+    def _create_image(self, **kwds):
+        self.created.append(kwds)
+        return "ami-new"
+
+    def _use_images(self, images):
+        self.ec2_conn = FakeEc2Connection(images)
+        self.launcher.boto_connection = lambda: self.ec2_conn
+
+    def test_hit(self):
+        self._use_images([FakeImage("ami-match", metadata={FINGERPRINT_TAG: self.fingerprint})])
+        self.assertEquals("ami-match", self.launcher.package())
+        self.assertEquals([], self.created)
+        self.assertEquals([], self.ec2_conn.tags)
+
+    def test_miss(self):
+        self._use_images([FakeImage("ami-other", metadata={FINGERPRINT_TAG: "other"})])
+        self.assertEquals("ami-new", self.launcher.package())
+        self.assertEquals(1, len(self.created))
+        self.assertEquals([(["ami-new"], {FINGERPRINT_TAG: self.fingerprint})], self.ec2_conn.tags)
+
+    def test_unusable_images_ignored(self):
+        self._use_images([FakeImage("ami-pending", state="pending", metadata={FINGERPRINT_TAG: self.fingerprint}),
+                          FakeImage("ami-failed", state="failed", metadata={FINGERPRINT_TAG: self.fingerprint})])
+        self.assertEquals("ami-new", self.launcher.package())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,93 @@
+import os
+import sys
+import subprocess
+import unittest
+
+import pkg_resources
+
+import vmlauncher
+from vmlauncher import get_driver_class, register_driver, build_vm_launcher
+from vmlauncher import DRIVER_CLASSES, DRIVER_ENTRY_POINT_GROUP
+from vmlauncher import Ec2VmLauncher, OpenstackVmLauncher, VagrantVmLauncher
+
+HEAVY_MODULES = ["libcloud", "fabric", "boto"]
+
+
+class FakeLauncher:
+
+    def __init__(self, driver_options_key, options):
+        self.driver_options_key = driver_options_key
+        self.options = options
+
+
+class FakeEntryPoint:
+
+    def __init__(self, name, target):
+        self.name = name
+        self.target = target
+
+    def load(self):
+        return self.target
+
+
+class DriverRegistryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.original_classes = dict(DRIVER_CLASSES)
+        self.original_iter_entry_points = pkg_resources.iter_entry_points
+        self.entry_points = []
+        pkg_resources.iter_entry_points = self._iter_entry_points
+
+    def tearDown(self):
+        DRIVER_CLASSES.clear()
+        DRIVER_CLASSES.update(self.original_classes)
+        pkg_resources.iter_entry_points = self.original_iter_entry_points
+
+    def _iter_entry_points(self, group, name=None):
+        self.assertEquals(DRIVER_ENTRY_POINT_GROUP, group)
+        return [entry_point for entry_point in self.entry_points if name in (None, entry_point.name)]
+
+    def test_builtin_drivers(self):
+        self.assertEquals(Ec2VmLauncher, get_driver_class("aws"))
+        self.assertEquals(OpenstackVmLauncher, get_driver_class("openstack"))
+        self.assertEquals(VagrantVmLauncher, get_driver_class("vagrant"))
+
+    def test_unknown_driver_falls_back_on_ec2(self):
+        self.assertEquals(Ec2VmLauncher, get_driver_class("unknown"))
+
+    def test_register_driver(self):
+        register_driver("fake", FakeLauncher)
+        self.assertEquals(FakeLauncher, get_driver_class("fake"))
+
+    def test_entry_point_fallback(self):
+        self.entry_points.append(FakeEntryPoint("fake", FakeLauncher))
+        self.assertEquals(FakeLauncher, get_driver_class("fake"))
+        # Loaded entry points are registered, so they are only looked up once.
+        self.entry_points = []
+        self.assertEquals(FakeLauncher, get_driver_class("fake"))
+
+    def test_registered_drivers_skip_entry_points(self):
+        self.entry_points.append(FakeEntryPoint("aws", FakeLauncher))
+        self.assertEquals(Ec2VmLauncher, get_driver_class("aws"))
+
+    def test_build_vm_launcher_uses_section_driver(self):
+        register_driver("fake", FakeLauncher)
+        options = {"vm_provider": "fake-project", "fake-project": {"driver": "fake"}}
+        launcher = build_vm_launcher(options)
+        self.assertTrue(isinstance(launcher, FakeLauncher))
+        self.assertEquals("fake-project", launcher.driver_options_key)
+
+
+class ImportTest(unittest.TestCase):
+
+    def test_import_is_lazy(self):
+        # Use a fresh interpreter, other tests may have loaded these already.
+        script = ("import sys, vmlauncher; "
+                  "print(','.join(m for m in %r if m in sys.modules))" % HEAVY_MODULES)
+        root = os.path.dirname(os.path.dirname(os.path.abspath(vmlauncher.__file__)))
+        output = subprocess.Popen([sys.executable, "-c", script], cwd=root, stdout=subprocess.PIPE).communicate()[0]
+        self.assertEquals("", output.strip())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,111 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+from vmlauncher import VmLauncher
+from vmlauncher.cache import connection_cache
+
+
+class FakeNode:
+    uuid = "node-uuid"
+
+
+class FakeDriver:
+
+    def __init__(self):
+        self.ssh_attempts = 0
+
+    def create_node(self, **kwds):
+        return FakeNode()
+
+    def list_nodes(self):
+        return [FakeNode()]
+
+    def destroy_node(self, node):
+        return True
+
+    def _ssh_client_connect(self, ssh_client, timeout):
+        self.ssh_attempts += 1
+        if self.ssh_attempts < 3:
+            raise Exception("Simulated SSH timeout")
+
+
+class FakeVmLauncher(VmLauncher):
+
+    def _get_connection(self):
+        return FakeDriver()
+
+    def _boot(self):
+        self.conn.list_nodes()
+        return self.conn.create_node(name="test")
+
+    def get_ip(self):
+        return "127.0.0.1"
+
+    def _VmLauncher__get_ssh_client(self):
+        return None
+
+
+class TraceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.key_file = os.path.join(self.temp_dir, "key")
+        open(self.key_file, "w").write("key")
+        self.trace_file = os.path.join(self.temp_dir, "trace.json")
+        connection_cache.clear()
+
+    def tearDown(self):
+        connection_cache.clear()
+        shutil.rmtree(self.temp_dir)
+
+    def test_launch_is_traced(self):
+        launcher = self._launcher(trace_file=self.trace_file)
+        launcher.boot_and_connect()
+        launcher.destroy()
+        trace = json.load(open(self.trace_file))
+        names = [event["name"] for event in trace["traceEvents"]]
+        for name in ["boot_and_connect", "_connect_driver", "_boot", "connect", "destroy",
+                     "create_node", "list_nodes", "destroy_node"]:
+            self.assertTrue(name in names, "No span for %s" % name)
+        for event in trace["traceEvents"]:
+            self.assertEquals("X", event["ph"])
+            self.assertTrue(event["dur"] >= 0)
+        counters = trace["otherData"]
+        self.assertEquals(1, counters["api_calls:create_node"])
+        self.assertEquals(1, counters["api_calls:list_nodes"])
+        self.assertEquals(1, counters["api_calls:destroy_node"])
+        self.assertEquals(2, counters["ssh_retries"])
+
+    def test_private_calls_not_counted(self):
+        launcher = self._launcher(trace=True)
+        launcher.boot_and_connect()
+        trace = launcher.tracer.to_chrome_trace()
+        self.assertFalse("api_calls:_ssh_client_connect" in trace["otherData"])
+        self.assertFalse("_ssh_client_connect" in [event["name"] for event in trace["traceEvents"]])
+
+    def test_write_trace_and_summary(self):
+        launcher = self._launcher(trace=True)
+        launcher.boot_and_connect()
+        launcher.write_trace(self.trace_file)
+        self.assertTrue(json.load(open(self.trace_file))["traceEvents"])
+        summary = launcher.trace_summary()
+        self.assertTrue("boot_and_connect" in summary)
+        self.assertTrue("api_calls:create_node" in summary)
+
+    def test_tracing_disabled(self):
+        launcher = self._launcher()
+        launcher.boot_and_connect()
+        self.assertRaises(Exception, launcher.write_trace, self.trace_file)
+        self.assertFalse(os.path.exists(self.trace_file))
+        self.assertEquals("Tracing not enabled.", launcher.trace_summary())
+
+    def _launcher(self, **options):
+        options.update({"key_file": self.key_file, "fake": {}})
+        return FakeVmLauncher("fake", options)
+
+
+if __name__ == "__main__":
+    unittest.main()
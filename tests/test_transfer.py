@@ -0,0 +1,232 @@
+import os
+import gzip
+import hashlib
+import shutil
+import tempfile
+import unittest
+
+from tests.helpers import ensure_fabric
+ensure_fabric()
+
+from vmlauncher import transfer, reassemble
+from vmlauncher.transfer import FileTransferManager, TransferException
+from vmlauncher.transport import LocalTransport
+from vmlauncher.artifacts import SharedVolumeArtifactStore
+
+FILE_SIZE = 3500000
+
+
+class FlakyTransport(LocalTransport):
+    """Fails the listed (1-based) put calls."""
+
+    def __init__(self, failing_puts):
+        self.failing_puts = failing_puts
+        self.puts = 0
+
+    def put(self, source, destination, owner=None, priority=None):
+        self.puts += 1
+        if self.puts in self.failing_puts:
+            raise Exception("Simulated upload failure")
+        LocalTransport.put(self, source, destination, owner)
+
+
+class BrokenTransport(LocalTransport):
+    """Always fails to upload files whose name contains broken_name."""
+
+    def __init__(self, broken_name):
+        self.broken_name = broken_name
+
+    def put(self, source, destination, owner=None, priority=None):
+        if self.broken_name in os.path.basename(source):
+            raise Exception("Simulated upload failure")
+        LocalTransport.put(self, source, destination, owner)
+
+
+class CorruptingTransport(LocalTransport):
+    """Flips a byte in the first uploaded file whose name contains corrupt_name."""
+
+    def __init__(self, corrupt_name):
+        self.corrupt_name = corrupt_name
+        self.corrupted = False
+
+    def put(self, source, destination, owner=None, priority=None):
+        LocalTransport.put(self, source, destination, owner)
+        if not self.corrupted and self.corrupt_name in os.path.basename(source):
+            self.corrupted = True
+            handle = open(destination, "r+b")
+            first = handle.read(1)
+            handle.seek(0)
+            handle.write(chr(ord(first) ^ 0xff))
+            handle.close()
+
+
+class FileTransferManagerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.source_dir = self._make_dir("source")
+        self.destination = os.path.join(self.temp_dir, "destination")
+        self.local_temp = self._make_dir("local_temp")
+        self.original_reassembler = transfer.REMOTE_REASSEMBLER
+        transfer.REMOTE_REASSEMBLER = os.path.join(self.temp_dir, "reassemble.py")
+        self.big_file = self._write_file("big", os.urandom(FILE_SIZE))
+        self.small_file = self._write_file("small", os.urandom(1000))
+
+    def tearDown(self):
+        transfer.REMOTE_REASSEMBLER = self.original_reassembler
+        shutil.rmtree(self.temp_dir)
+
+    def test_chunked_compressed_round_trip(self):
+        self._transfer_and_check(chunk_size=1, verify_checksums=True)
+
+    def test_chunked_uncompressed_round_trip(self):
+        self._transfer_and_check(chunk_size=1, compress=False, verify_checksums=True)
+
+    def test_serial_reassembly_round_trip(self):
+        self._transfer_and_check(chunk_size=1, verify_checksums=True, parallel_reassembly=False)
+
+    def test_unchunked_round_trip(self):
+        self._transfer_and_check(chunk_size=0, verify_checksums=True)
+
+    def test_precompressed_chunked_round_trip(self):
+        compressed_file = os.path.join(self.source_dir, "pre.gz")
+        output = gzip.open(compressed_file, "wb")
+        output.write(open(self.big_file, "rb").read())
+        output.close()
+        manager = self._manager(chunk_size=1, verify_checksums=True)
+        manager.transfer_files(compressed_files=[compressed_file])
+        self._assert_transferred(self.big_file, "pre")
+
+    def test_checksums_recorded(self):
+        manager = self._manager(chunk_size=1, verify_checksums=True, parallel_reassembly=False)
+        summary = manager.transfer_files([self.big_file])
+        target = summary.transfer_targets[0]
+        contents = open(self.big_file, "rb").read()
+        self.assertEquals(hashlib.sha256(contents).hexdigest(), target.checksum)
+        self.assertEquals(FILE_SIZE, target.file_size)
+        self.assertEquals(4, len(target.chunk_checksums))
+        self.assertEquals(hashlib.sha256(contents[:1024 * 1024]).hexdigest(), target.chunk_checksums[0])
+
+    def test_serial_corruption_detected(self):
+        self._assert_corruption_detected(chunk_size=1, compress=False, parallel_reassembly=False)
+
+    def test_parallel_corruption_detected(self):
+        self._assert_corruption_detected(chunk_size=1, compress=False)
+
+    def test_empty_file(self):
+        self._assert_empty_file_transferred(chunk_size=1, verify_checksums=True)
+
+    def test_empty_file_serial_reassembly(self):
+        self._assert_empty_file_transferred(chunk_size=1, verify_checksums=True, parallel_reassembly=False)
+
+    def test_unchunked_corruption_detected(self):
+        self._assert_corruption_detected(chunk_size=0, compress=False)
+
+    def test_failed_uploads_are_retried(self):
+        transport = FlakyTransport(failing_puts=[2, 3])
+        manager = self._manager(chunk_size=1, transport=transport, num_transfer_threads=2)
+        summary = manager.transfer_files([self.big_file, self.small_file])
+        self._assert_transferred(self.big_file, "big")
+        self._assert_transferred(self.small_file, "small")
+        self.assertEquals(2, sum([target.retries for target in summary.transfer_targets]))
+        self.assertEquals(2, len(summary.succeeded()))
+
+    def test_exhausted_retries_raise_summary(self):
+        manager = self._manager(chunk_size=1, transport=BrokenTransport("small"), transfer_retries=3)
+        try:
+            manager.transfer_files([self.big_file, self.small_file])
+            self.fail("Expected TransferException")
+        except TransferException as e:
+            summary = e.summary
+        self._assert_transferred(self.big_file, "big")
+        failed = summary.failed()
+        self.assertEquals([self.small_file], [target.file for target in failed])
+        self.assertEquals(2, failed[0].retries)
+        self.assertTrue("after 3 attempt(s)" in failed[0].errors[0])
+        self.assertTrue("%s: failed (" % self.small_file in str(summary))
+        self.assertTrue("%s: ok, 0 retries" % self.big_file in str(summary))
+
+    def test_run_retry_cap(self):
+        manager = self._manager(chunk_size=1, transport=BrokenTransport("small"), transfer_retries=5, max_run_retries=1)
+        summary = manager.transfer_files([self.small_file], raise_on_failure=False)
+        self.assertEquals(1, summary.failed()[0].retries)
+
+    def test_artifact_store(self):
+        store = SharedVolumeArtifactStore(self._make_dir("store"))
+        first = self._manager(chunk_size=1, artifact_store=store).transfer_files([self.big_file, self.small_file])
+        self.assertEquals(0, first.bytes_avoided())
+        self.assertFalse([target for target in first.transfer_targets if target.from_artifact_store])
+        self._assert_transferred(self.big_file, "big")
+
+        shutil.rmtree(self.destination)
+        transport = FlakyTransport(failing_puts=[])
+        second = self._manager(chunk_size=1, artifact_store=store, transport=transport).transfer_files([self.big_file, self.small_file])
+        self.assertEquals(FILE_SIZE + 1000, second.bytes_avoided())
+        self.assertEquals(0, transport.puts)
+        self._assert_transferred(self.big_file, "big")
+        self._assert_transferred(self.small_file, "small")
+        self.assertTrue("ok (from artifact store)" in str(second))
+
+    def _transfer_and_check(self, **kwds):
+        manager = self._manager(**kwds)
+        summary = manager.transfer_files([self.big_file, self.small_file])
+        self.assertEquals(2, len(summary.succeeded()))
+        self._assert_transferred(self.big_file, "big")
+        self._assert_transferred(self.small_file, "small")
+        self.assertEquals(["big", "small"], sorted(os.listdir(self.destination)))
+
+    def _assert_corruption_detected(self, **kwds):
+        manager = self._manager(transport=CorruptingTransport("big"), verify_checksums=True, **kwds)
+        summary = manager.transfer_files([self.big_file, self.small_file], raise_on_failure=False)
+        self.assertEquals([self.small_file], [target.file for target in summary.succeeded()])
+        self.assertTrue("Checksum mismatch" in summary.failed()[0].errors[0])
+
+    def _assert_empty_file_transferred(self, **kwds):
+        empty_file = self._write_file("empty", "")
+        summary = self._manager(**kwds).transfer_files([empty_file, self.small_file])
+        self.assertEquals(2, len(summary.succeeded()))
+        self._assert_transferred(empty_file, "empty")
+        self.assertEquals(["empty", "small"], sorted(os.listdir(self.destination)))
+
+    def _manager(self, **kwds):
+        kwds.setdefault("transport", LocalTransport())
+        kwds.setdefault("retry_delay", 0.01)
+        return FileTransferManager(destination=self.destination, local_temp=self.local_temp, **kwds)
+
+    def _assert_transferred(self, source, name):
+        expected = open(source, "rb").read()
+        actual = open(os.path.join(self.destination, name), "rb").read()
+        self.assertTrue(expected == actual, "Transferred %s does not match %s" % (name, source))
+
+    def _make_dir(self, name):
+        path = os.path.join(self.temp_dir, name)
+        os.makedirs(path)
+        return path
+
+    def _write_file(self, name, contents):
+        path = os.path.join(self.source_dir, name)
+        open(path, "wb").write(contents)
+        return path
+
+
+class ReassembleTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.destination = os.path.join(self.temp_dir, "file")
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_no_parts(self):
+        reassemble.main(["0", "1048576", self.destination, "%s_part*" % self.destination])
+        self.assertEquals(0, os.path.getsize(self.destination))
+
+    def test_missing_parts_rejected(self):
+        part = "%s_part00000000" % self.destination
+        open(part, "wb").write("a" * 10)
+        self.assertRaises(Exception, reassemble.main, ["20", "10", self.destination, part])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,17 +1,39 @@
 import os
 import time
+import hashlib
+import calendar
 
-from libcloud.compute.ssh import SSHClient
-from libcloud.compute.base import NodeImage, NodeSize
-from libcloud.compute.types import Provider
-from libcloud.compute.providers import get_driver
+from threading import Thread
+from Queue import Queue
+
+from vmlauncher.cache import TokenStore, TokenFallbackConnection, connection_cache
+from vmlauncher.trace import build_tracer
 
 # Ubuntu 10.04 LTS (Lucid Lynx) Daily Build [20120302]
 DEFAULT_AWS_IMAGE_ID = "ami-0bf6af4e"
 DEFAULT_AWS_SIZE_ID = "m1.large"
 DEFAULT_AWS_AVAILABILITY_ZONE = "us-west-1"
 
-from fabric.api import local, env, sudo, put, run
+# libcloud and fabric are comparatively expensive to import, so they are
+# imported in the methods that use them rather than at module load.
+
+# Entry point group third-party packages can use to provide additional
+# VmLauncher implementations, keyed on driver name.
+DRIVER_ENTRY_POINT_GROUP = "vmlauncher.drivers"
+
+# Image tag/metadata key packaged images' input fingerprints are stored under.
+FINGERPRINT_TAG = "vmlauncher-fingerprint"
+
+# Lifecycle methods recorded as spans when tracing is enabled.
+TRACED_METHODS = ['boot_and_connect',
+                  '_connect_driver',
+                  '_boot',
+                  'create_node',
+                  'get_ip',
+                  'connect',
+                  'attach_public_ip',
+                  'package',
+                  'destroy']
 
 
 class VmLauncher:
@@ -19,7 +41,10 @@ class VmLauncher:
     def __init__(self, driver_options_key, options):
         self.driver_options_key = driver_options_key
         self.options = options
+        self.fingerprint_inputs = {}
+        self.fingerprint_files = {}
         self.__set_and_verify_key()
+        self.__setup_tracing()
 
     def __set_and_verify_key(self):
         key_file = self.options.get('key_file', None)
@@ -30,6 +55,23 @@ class VmLauncher:
         if not os.path.exists(self.key_file):
             raise Exception("Invalid or unspecified key_file option: %s" % self.key_file)
 
+    def __setup_tracing(self):
+        self.tracer = build_tracer(self.options)
+        for method_name in TRACED_METHODS:
+            method = getattr(self, method_name, None)
+            if method:
+                setattr(self, method_name, self.tracer.wrap(method_name, method))
+
+    def write_trace(self, path=None):
+        """
+        Write recorded spans as Chrome trace JSON (requires the trace or
+        trace_file option).
+        """
+        self.tracer.write(path)
+
+    def trace_summary(self):
+        return self.tracer.summary()
+
     def _get_driver_options(self, driver_option_keys):
         driver_options = {}
         for key in driver_option_keys:
@@ -53,9 +95,15 @@ class VmLauncher:
 
     def _connect_driver(self):
         if not getattr(self, 'conn', None):
-            self.conn = self._get_connection()
+            conn = connection_cache.get(self._connection_cache_key(), self._get_connection)
+            self.conn = self.tracer.trace_connection(conn)
         return self.conn
 
+    def _connection_cache_key(self):
+        # Not every driver requires a section (e.g. vagrant).
+        driver_options = self.options.get(self.driver_options_key) or {}
+        return (self.driver_options_key, repr(sorted(driver_options.items())))
+
     def _wait_for_node_info(self, f):
         initial_value = f(self.node)
         if initial_value:
@@ -90,6 +138,7 @@ class VmLauncher:
         ip = self.get_ip()  # Subclasses should implement this
         key_file = self.get_key_file()
         # Had to add timeout to this line to avoid the SSH connection locking up the build
+        from libcloud.compute.ssh import SSHClient
         ssh_client = SSHClient(hostname=ip,
                                port=self.get_ssh_port(),
                                username=self.get_user(),
@@ -116,8 +165,17 @@ class VmLauncher:
                 return
             except:
                 print 'Connection Timeout. Retrying...'
+                self.tracer.count('ssh_retries')
                 i = i + 1
 
+    def get_transport(self):
+        """
+        Build the transport FileTransferManager should use to stage files on
+        this VM.
+        """
+        from vmlauncher.transport import SshTransport
+        return SshTransport()
+
     def list(self):
         self._connect_driver()
         return self.conn.list_nodes()
@@ -149,6 +207,7 @@ class VmLauncher:
         return node
 
     def _image_from_id(self, image_id=None):
+        from libcloud.compute.base import NodeImage
         image = NodeImage(id=image_id, name="", driver="")
         return image
 
@@ -170,6 +229,7 @@ class VmLauncher:
         return "size_id"
 
     def _size_from_id(self, size_id):
+        from libcloud.compute.base import NodeSize
         size = NodeSize(id=size_id, name="", ram=None, disk=None, bandwidth=None, price=None, driver="")
         return size
 
@@ -201,6 +261,68 @@ class VmLauncher:
         description = self._driver_options().get("package_image_description", default)
         return description
 
+    def add_fingerprint_input(self, name, value):
+        """
+        Include an additional named value (e.g. the checksum of a file that
+        will be staged) in the fingerprint of packaged images.
+        """
+        self.fingerprint_inputs[name] = value
+
+    def add_fingerprint_file(self, path):
+        """
+        Include the contents of a file or directory (e.g. provisioning
+        scripts) in the fingerprint of packaged images. Files are keyed on
+        their path relative to the parent of path (e.g. scripts/setup.sh), so
+        the fingerprint does not depend on where the inputs are checked out.
+        """
+        path = os.path.abspath(os.path.expanduser(path))
+        base = os.path.dirname(path)
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    self._add_fingerprint_file(os.path.join(root, name), base)
+        else:
+            self._add_fingerprint_file(path, base)
+
+    def _add_fingerprint_file(self, path, base):
+        from vmlauncher.transfer import hash_file
+        name = "file:%s" % os.path.relpath(path, base).replace(os.sep, "/")
+        if name in self.fingerprint_files:
+            if self.fingerprint_files[name] != path:
+                raise Exception("Fingerprint files %s and %s would both be keyed as %s" %
+                                (self.fingerprint_files[name], path, name))
+            # Files may be large, only hash each once per launcher.
+            return
+        self.fingerprint_files[name] = path
+        self.add_fingerprint_input(name, hash_file(path))
+
+    def package_fingerprint(self):
+        """
+        Digest of the inputs determining a packaged image - the base image,
+        the package_fingerprint_files option and any added fingerprint inputs.
+        """
+        for path in self._driver_options().get("package_fingerprint_files", []):
+            self.add_fingerprint_file(path)
+        fingerprint = hashlib.sha256()
+        fingerprint.update("image_id=%s\n" % self._get_image_id())
+        for name in sorted(self.fingerprint_inputs):
+            fingerprint.update("%s=%s\n" % (name, self.fingerprint_inputs[name]))
+        return fingerprint.hexdigest()
+
+    def find_packaged_image(self):
+        """
+        Return the id of a previously packaged image built from identical
+        inputs, or None. Callers may use this to skip booting entirely.
+        """
+        if not self._driver_options().get("package_fingerprint", False):
+            return None
+        return self._find_image_by_fingerprint(self.package_fingerprint())
+
+    def _find_image_by_fingerprint(self, fingerprint):
+        # Subclasses supporting fingerprinted packaging should override.
+        return None
+
 
 class VagrantConnection:
     """'Fake' connection type to mimic libcloud's but for Vagrant"""
@@ -209,6 +331,7 @@ class VagrantConnection:
         pass
 
     def destroy_node(self, node=None):
+        from fabric.api import local
         local("vagrant halt")
 
     def list_nodes(self):
@@ -225,7 +348,7 @@ class VagrantNode:
 class VagrantVmLauncher(VmLauncher):
     """Launches vagrant VMs."""
 
-    def _get_connection():
+    def _get_connection(self):
         return VagrantConnection()
 
     def __init__(self, driver_options_key, options):
@@ -235,6 +358,7 @@ class VagrantVmLauncher(VmLauncher):
         self.uuid = "test"
 
     def _boot(self):
+        from fabric.api import local
         local("vagrant up")
         return VagrantNode()
 
@@ -244,7 +368,15 @@ class VagrantVmLauncher(VmLauncher):
     def get_user(self):
         return "vagrant"
 
+    def get_transport(self):
+        from vmlauncher.transport import SyncedFolderTransport
+        vagrant_options = self.options.get(self.driver_options_key) or {}
+        host_folder = vagrant_options.get("synced_folder", os.getcwd())
+        guest_folder = vagrant_options.get("guest_synced_folder", "/vagrant")
+        return SyncedFolderTransport(host_folder, guest_folder)
+
     def package(self, **kwds):
+        from fabric.api import local
         local("vagrant package")
 
 
@@ -291,7 +423,7 @@ class OpenstackVmLauncher(VmLauncher):
         return active_node
 
     def _get_connection(self):
-        driver = get_driver(Provider.OPENSTACK)
+        driver = _get_libcloud_driver("OPENSTACK")
         openstack_username = self._driver_options()['username']
         openstack_api_key = self._driver_options()['password']
 
@@ -305,18 +437,82 @@ class OpenstackVmLauncher(VmLauncher):
 
         driver_options = self._get_driver_options(driver_option_keys)
         print driver_options
-        conn = driver(openstack_username,
-                      openstack_api_key,
-                      **driver_options)
-        return conn
+
+        token_store = self._token_store()
+        if not token_store:
+            return driver(openstack_username, openstack_api_key, **driver_options)
+
+        # Only a digest of the password is kept, so changing it invalidates
+        # the cached token without the password being stored.
+        identity = [openstack_username,
+                    hashlib.sha256(openstack_api_key).hexdigest(),
+                    dict(driver_options)]
+
+        def authenticate():
+            conn = driver(openstack_username, openstack_api_key, **driver_options)
+            self._cache_auth_token(conn, token_store, identity)
+            return conn
+
+        cached_token = token_store.get(self.driver_options_key, identity)
+        if not cached_token:
+            return authenticate()
+
+        def reauthenticate():
+            print "Cached auth token rejected, reauthenticating."
+            token_store.remove(self.driver_options_key)
+            return authenticate()
+
+        token_driver_options = dict(driver_options)
+        token_driver_options['ex_force_auth_token'] = cached_token['token']
+        token_driver_options.setdefault('ex_force_base_url', cached_token['base_url'])
+        conn = driver(openstack_username, openstack_api_key, **token_driver_options)
+        return TokenFallbackConnection(conn, reauthenticate)
+
+    def _token_store(self):
+        if not self._driver_options().get('cache_auth_token', False):
+            return None
+        return TokenStore(self._driver_options().get('auth_token_cache', None))
+
+    def _cache_auth_token(self, conn, token_store, identity):
+        connection = conn.connection
+        # Authenticate now rather than on the first request so the token and
+        # service endpoint are available to be stored.
+        connection._populate_hosts_and_request_paths()
+        expires = connection.auth_token_expires
+        if not connection.auth_token or not expires:
+            return
+        token_store.put(self.driver_options_key,
+                        identity,
+                        connection.auth_token,
+                        calendar.timegm(expires.utctimetuple()),
+                        connection.get_endpoint())
 
     def package(self, **kwds):
+        existing_image_id = self.find_packaged_image()
+        if existing_image_id:
+            print "Image %s was packaged from identical inputs, skipping packaging." % existing_image_id
+            return existing_image_id
         print "sleeping 60s while Galaxy loads completely..."
         time.sleep(60)
         print 'Packaging instance...'
         name = kwds.get("name", self.package_image_name())
-        self.conn.ex_save_image(self.node, name)
+        save_kwds = {}
+        if self._driver_options().get("package_fingerprint", False):
+            save_kwds["metadata"] = {FINGERPRINT_TAG: self.package_fingerprint()}
+        image = self.conn.ex_save_image(self.node, name, **save_kwds)
         print "Packaging Done."
+        return image.id
+
+    def _find_image_by_fingerprint(self, fingerprint):
+        self._connect_driver()
+        for image in self.conn.list_images():
+            if image.extra.get("status") != "ACTIVE":
+                # Still saving (or failed), not usable yet.
+                continue
+            metadata = image.extra.get("metadata") or {}
+            if metadata.get(FINGERPRINT_TAG) == fingerprint:
+                return image.id
+        return None
 
     def attach_public_ip(self, public_ip=None):
         if not public_ip:
@@ -330,7 +526,7 @@ class EucalyptusVmLauncher(VmLauncher):
         return self._wait_for_node_info(lambda node: node.public_ips)
 
     def _get_connection(self):
-        driver = get_driver(Provider.EUCALYPTUS)
+        driver = _get_libcloud_driver("EUCALYPTUS")
         driver_option_keys = ['secret',
                               'secure',
                               'port',
@@ -372,22 +568,54 @@ class Ec2VmLauncher(VmLauncher):
         return region.connect(aws_access_key_id=ec2_access_id, aws_secret_access_key=ec2_secret_key)
 
     def boto_s3_connection(self):
-        from boto.s3.connection import S3Connection
+        from boto.s3.connection import S3Connection, OrdinaryCallingFormat
         ec2_access_id = self.access_id()
         ec2_secret_key = self.secret_key()
-        return S3Connection(ec2_access_id, ec2_secret_key)
+        s3_options = {}
+        # Allow pointing at an S3 compatible stand-in (e.g. a local fake S3
+        # server) instead of Amazon.
+        if "s3_host" in self._driver_options():
+            s3_options["host"] = self._driver_options()["s3_host"]
+            s3_options["port"] = int(self._driver_options().get("s3_port", 80))
+            s3_options["is_secure"] = self._driver_options().get("s3_secure", False)
+            s3_options["calling_format"] = OrdinaryCallingFormat()
+        return S3Connection(ec2_access_id, ec2_secret_key, **s3_options)
 
     def _default_image_id(self):
         return DEFAULT_AWS_IMAGE_ID
 
     def package(self, **kwds):
         package_type = self._driver_options().get('package_type', 'default')
+        if package_type in ["create_image", "upload_bundle"]:
+            existing_image_id = self.find_packaged_image()
+            if existing_image_id:
+                print "Image %s was packaged from identical inputs, skipping packaging." % existing_image_id
+                return existing_image_id
         if package_type == "create_image":
-            self._create_image(**kwds)
+            image_id = self._create_image(**kwds)
+        elif package_type == "upload_bundle":
+            image_id = self._upload_bundle_package(**kwds)
         else:
             self._default_package(**kwds)
+            return None
+        self._tag_fingerprint(image_id)
+        return image_id
+
+    def _tag_fingerprint(self, image_id):
+        if self._driver_options().get("package_fingerprint", False):
+            self.boto_connection().create_tags([image_id], {FINGERPRINT_TAG: self.package_fingerprint()})
+
+    def _find_image_by_fingerprint(self, fingerprint):
+        images = self.boto_connection().get_all_images(owners=['self'],
+                                                       filters={'tag:%s' % FINGERPRINT_TAG: fingerprint})
+        for image in images:
+            # Skip images still pending registration, or failed.
+            if image.state == 'available':
+                return image.id
+        return None
 
     def _create_image(self, **kwds):
+        from fabric.api import run
         ec2_conn = self.boto_connection()
         instance_id = run("curl --silent http://169.254.169.254/latest/meta-data/instance-id")
 
@@ -404,20 +632,70 @@ class Ec2VmLauncher(VmLauncher):
         image_id = ec2_conn.create_image(instance_id, name=name, description=description)
         if self._driver_options().get("make_public", False):
             ec2_conn.modify_image_attribute(image_id, attribute='launchPermission', operation='add', groups=['all'])
+        return image_id
 
     def _default_package(self, **kwds):
+        from fabric.api import env, sudo
         env.packaging_dir = "/mnt/packaging"
         sudo("mkdir -p %s" % env.packaging_dir)
         self._copy_keys()
         self._install_ec2_tools()
         self._install_packaging_scripts()
 
+    def _upload_bundle_package(self, **kwds):
+        """
+        Bundle the instance, upload the bundle parts to S3 in parallel from
+        the remote instance and register the resulting manifest.
+        """
+        from fabric.api import env, sudo
+        env.packaging_dir = "/mnt/packaging"
+        bundle_dir = "%s/bundle" % env.packaging_dir
+        sudo("mkdir -p %s" % bundle_dir)
+        self._copy_keys()
+        self._install_ec2_tools()
+
+        user_id = self._driver_options()["user_id"]
+        manifest = "image.manifest.xml"
+        # Skip rebundling if a previous attempt got this far, so uploads can
+        # be resumed.
+        if sudo("test -e %s/%s" % (bundle_dir, manifest), warn_only=True).failed:
+            sudo("ec2-bundle-vol -k %s/ec2_key -c %s/ec2_cert -u %s -d %s -e %s" %
+                 (env.packaging_dir, env.packaging_dir, user_id, bundle_dir, env.packaging_dir))
+
+        bucket_name = self._driver_options()["package_bucket"]
+        s3_conn = self.boto_s3_connection()
+        bucket = s3_conn.lookup(bucket_name)
+        if bucket is None:
+            bucket = s3_conn.create_bucket(bucket_name)
+
+        parts = sudo("cd %s; ls -1 image.part.*" % bundle_dir).split()
+        uploader = BundleUploader(s3_conn,
+                                  bucket,
+                                  bundle_dir,
+                                  num_threads=int(self._driver_options().get("package_upload_threads", 4)),
+                                  retries=int(self._driver_options().get("package_upload_retries", 3)))
+        uploader.upload(parts)
+        # Manifest goes up last, so a registered manifest never references
+        # missing parts. It is always uploaded, never resumed.
+        uploader.upload([manifest], resume=False)
+
+        name = kwds.get("name", self.package_image_name())
+        description = kwds.get("description", self.package_image_description(default=""))
+        ec2_conn = self.boto_connection()
+        image_id = ec2_conn.register_image(name=name,
+                                           description=description,
+                                           image_location="%s/%s" % (bucket_name, manifest))
+        print "Registered image %s" % image_id
+        return image_id
+
     def _install_ec2_tools(self):
+        from fabric.api import sudo
         sudo("apt-add-repository ppa:awstools-dev/awstools")
         sudo("apt-get update")
         sudo('export DEBIAN_FRONTEND=noninteractive; sudo -E apt-get install ec2-api-tools ec2-ami-tools -y --force-yes')
 
     def _install_packaging_scripts(self):
+        from fabric.api import env
         user_id = self._driver_options()["user_id"]
         bundle_cmd = "sudo ec2-bundle-vol -k %s/ec2_key -c%s/ec2_cert -u %s" % \
             (env.packaging_dir, env.packaging_dir, user_id)
@@ -435,11 +713,13 @@ class Ec2VmLauncher(VmLauncher):
         self._write_script("%s/register_bundle.sh" % env.packaging_dir, register_cmd)
 
     def _write_script(self, path, contents):
+        from fabric.api import sudo
         full_contents = "#!/bin/bash\n%s" % contents
         sudo("echo '%s' > %s" % (full_contents, path))
         sudo("chmod +x %s" % path)
 
     def _copy_keys(self):
+        from fabric.api import env, put
         ec2_key_path = self._driver_options()["x509_key"]
         ec2_cert_path = self._driver_options()["x509_cert"]
         put(ec2_key_path, "%s/ec2_key" % env.packaging_dir, use_sudo=True)
@@ -491,13 +771,150 @@ class Ec2VmLauncher(VmLauncher):
         self.conn.ex_associate_addresses(self.node, public_ip)
 
     def _get_connection(self):
-        driver = get_driver(Provider.EC2)
+        driver = _get_libcloud_driver("EC2")
         ec2_access_id = self.access_id()
         ec2_secret_key = self.secret_key()
         conn = driver(ec2_access_id, ec2_secret_key)
         return conn
 
 
+class BundleUploader:
+    """
+    Uploads EC2 bundle parts sitting on the remote instance to S3 using a
+    bounded pool of worker threads. Each worker has the instance PUT its part
+    to a presigned URL, so the data never passes through the local machine.
+
+    When resuming, parts whose S3 ETag matches the MD5 of the part on the
+    instance are skipped. Bundles share key names (image.part.NN), so a
+    matching size alone could be a part left over from a different build.
+    """
+
+    def __init__(self, s3_conn, bucket, bundle_dir, num_threads=4, retries=3, url_expires=3600):
+        self.s3_conn = s3_conn
+        self.bucket = bucket
+        self.bundle_dir = bundle_dir
+        self.num_threads = num_threads
+        self.retries = retries
+        self.url_expires = url_expires
+
+    def upload(self, parts, resume=True):
+        self.resume = resume
+        self.failed_parts = []
+        self.part_queue = Queue()
+        for part in parts:
+            self.part_queue.put(part)
+        num_threads = min(self.num_threads, len(parts))
+        # One sentinel per worker, so every worker exits once the parts run out.
+        for thread_index in range(num_threads):
+            self.part_queue.put(None)
+        threads = []
+        for thread_index in range(num_threads):
+            t = Thread(target=self._upload_parts)
+            t.daemon = True
+            t.start()
+            threads.append(t)
+        for t in threads:
+            t.join()
+        if self.failed_parts:
+            raise Exception("Failed to upload bundle parts %s" % ", ".join(sorted(self.failed_parts)))
+
+    def _upload_parts(self):
+        while True:
+            part = self.part_queue.get()
+            if part is None:
+                return
+            try:
+                if not self._upload_part(part):
+                    self.failed_parts.append(part)
+            except (Exception, SystemExit) as e:
+                # Fabric aborts raise SystemExit, catch those too so a part
+                # is never silently dropped and the worker keeps going.
+                print "Failed to upload bundle part %s - %s" % (part, e)
+                self.failed_parts.append(part)
+
+    def _upload_part(self, part):
+        from fabric.api import sudo
+        part_path = "%s/%s" % (self.bundle_dir, part)
+        md5sum = sudo("md5sum %s" % part_path, warn_only=True)
+        if md5sum.failed:
+            print "Failed to find bundle part %s" % part_path
+            return False
+        md5 = md5sum.split()[0]
+        for attempt in range(self.retries):
+            try:
+                if self._upload_part_attempt(part, part_path, md5):
+                    return True
+            except (Exception, SystemExit) as e:
+                print e
+            print "Failed to upload bundle part %s on attempt %d" % (part, attempt + 1)
+        return False
+
+    def _upload_part_attempt(self, part, part_path, md5):
+        from fabric.api import sudo
+        if self.resume and self._already_uploaded(part, md5):
+            print "Bundle part %s already uploaded, skipping." % part
+            return True
+        headers = {"x-amz-acl": "aws-exec-read"}
+        url = self.s3_conn.generate_url(self.url_expires,
+                                        "PUT",
+                                        bucket=self.bucket.name,
+                                        key=part,
+                                        headers=headers)
+        result = sudo("curl --fail --silent --show-error -X PUT -H 'x-amz-acl: aws-exec-read' -T %s '%s'" % (part_path, url),
+                      warn_only=True)
+        return not result.failed and self._already_uploaded(part, md5)
+
+    def _already_uploaded(self, part, md5):
+        # Parts are sent in a single PUT, so their ETag is the MD5 of the
+        # content.
+        key = self.bucket.get_key(part)
+        return key is not None and key.etag.strip('"') == md5
+
+
+def _get_libcloud_driver(provider):
+    """
+    Load the libcloud driver for the named ``Provider`` constant, only
+    importing libcloud's provider machinery the first time a driver is used.
+    """
+    from libcloud.compute.types import Provider
+    from libcloud.compute.providers import get_driver
+    return get_driver(getattr(Provider, provider))
+
+
+DRIVER_CLASSES = {'aws': Ec2VmLauncher,
+                  'openstack': OpenstackVmLauncher,
+                  'vagrant': VagrantVmLauncher,
+                  'eucalyptus': EucalyptusVmLauncher}
+
+
+def register_driver(name, driver_class):
+    """
+    Register a VmLauncher subclass to be used for the supplied driver name.
+    """
+    DRIVER_CLASSES[name] = driver_class
+
+
+def get_driver_class(driver):
+    """
+    Find the VmLauncher class for the supplied driver name, consulting the
+    ``vmlauncher.drivers`` entry points of installed packages only if the
+    driver is not already registered. Falls back on EC2.
+    """
+    if driver not in DRIVER_CLASSES:
+        _load_driver_entry_points(driver)
+    return DRIVER_CLASSES.get(driver, Ec2VmLauncher)
+
+
+def _load_driver_entry_points(driver):
+    try:
+        import pkg_resources
+    except ImportError:
+        return
+    for entry_point in pkg_resources.iter_entry_points(DRIVER_ENTRY_POINT_GROUP, name=driver):
+        register_driver(driver, entry_point.load())
+        break
+
+
 def build_vm_launcher(options):
     provider_option_key = 'vm_provider'
     # HACK to maintain backward compatibity on vm_host option
@@ -514,9 +931,6 @@ def build_vm_launcher(options):
         # set.
         provider_options = options.get(driver)
         driver = provider_options.get('driver', driver)
-    driver_classes = {'openstack': OpenstackVmLauncher,
-                      'vagrant': VagrantVmLauncher,
-                      'eucalyptus': EucalyptusVmLauncher}
-    driver_class = driver_classes.get(driver, Ec2VmLauncher)
+    driver_class = get_driver_class(driver)
     vm_launcher = driver_class(driver_options_key, options)
     return vm_launcher
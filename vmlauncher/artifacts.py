@@ -0,0 +1,68 @@
+"""
+Content addressed stores FileTransferManager can check before uploading a
+file, so identical files staged to many instances are only uploaded once.
+
+Stores are keyed on the SHA-256 digest of the local file and hold the file as
+it should appear on the remote host. Remote commands are run via the run
+callable supplied by FileTransferManager, which executes them as the transfer
+user in the transfer destination directory.
+"""
+
+
+class SharedVolumeArtifactStore:
+    """
+    Store living on a volume shared by (or attached to) the target VMs, e.g.
+    an NFS mount. Hits are materialized with a reflink copy where the
+    filesystem supports it.
+    """
+
+    def __init__(self, path):
+        self.path = path.rstrip("/")
+
+    def contains(self, key, run):
+        output = run("test -e '%s' && echo hit || echo miss" % self._key_path(key))
+        return output.strip().endswith("hit")
+
+    def materialize(self, key, destination, run):
+        run("cp --reflink=auto '%s' '%s'" % (self._key_path(key), destination))
+
+    def populate(self, key, source, run):
+        key_path = self._key_path(key)
+        temp_path = "%s.tmp.$$" % key_path
+        # Copy then rename so a concurrent reader never sees a partial file.
+        run("mkdir -p '%s' && cp '%s' \"%s\" && mv \"%s\" '%s'" %
+            (key_path.rsplit("/", 1)[0], source, temp_path, temp_path, key_path))
+
+    def _key_path(self, key):
+        return "%s/%s/%s" % (self.path, key[:2], key)
+
+
+class S3ArtifactStore:
+    """
+    Store in an S3 bucket reachable from the target VMs. Lookups are made
+    locally with boto, while the VM downloads or uploads the file itself via
+    presigned URLs, so the data never passes through the local machine.
+    """
+
+    def __init__(self, s3_conn, bucket_name, prefix="vmlauncher-artifacts/", url_expires=3600):
+        self.s3_conn = s3_conn
+        self.bucket = s3_conn.get_bucket(bucket_name)
+        self.prefix = prefix
+        self.url_expires = url_expires
+
+    def contains(self, key, run):
+        return self.bucket.get_key(self._key_name(key)) is not None
+
+    def materialize(self, key, destination, run):
+        url = self._url("GET", key)
+        run("curl --fail --silent --show-error -o '%s' '%s'" % (destination, url))
+
+    def populate(self, key, source, run):
+        url = self._url("PUT", key)
+        run("curl --fail --silent --show-error -X PUT -T '%s' '%s'" % (source, url))
+
+    def _url(self, method, key):
+        return self.s3_conn.generate_url(self.url_expires, method, bucket=self.bucket.name, key=self._key_name(key))
+
+    def _key_name(self, key):
+        return "%s%s" % (self.prefix, key)
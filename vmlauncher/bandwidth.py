@@ -0,0 +1,102 @@
+import heapq
+import time
+
+from threading import Condition
+
+# Priority classes for uploads, lower values are given bandwidth first.
+HIGH_PRIORITY = 0
+NORMAL_PRIORITY = 1
+LOW_PRIORITY = 2
+
+
+class BandwidthLimiter:
+    """
+    Token bucket shared by every upload in the process. Uploads reserve each
+    block of bytes as they read it; waiting uploads are granted bandwidth in
+    priority order (first come first served within a class). A reservation may
+    take the bucket into debt, the next one then waits until it is repaid.
+
+    The rate (in bytes per second) may be changed at any time with set_rate,
+    a rate of None disables limiting.
+    """
+
+    def __init__(self, rate=None, burst_seconds=1.0):
+        self.rate = rate
+        self.burst_seconds = burst_seconds
+        self.tokens = 0.0
+        self.last_refill = time.time()
+        self.waiting = []
+        self.sequence = 0
+        self.condition = Condition()
+
+    def set_rate(self, rate):
+        self.condition.acquire()
+        try:
+            self._refill()
+            self.rate = rate
+            self.condition.notifyAll()
+        finally:
+            self.condition.release()
+
+    def acquire(self, num_bytes, priority=NORMAL_PRIORITY):
+        self.condition.acquire()
+        try:
+            self.sequence += 1
+            ticket = (priority, self.sequence)
+            heapq.heappush(self.waiting, ticket)
+            while True:
+                self._refill()
+                if self.waiting[0] == ticket and (self.rate is None or self.tokens > 0):
+                    break
+                self.condition.wait(self._wait_time())
+            heapq.heappop(self.waiting)
+            if self.rate is not None:
+                self.tokens -= num_bytes
+            self.condition.notifyAll()
+        finally:
+            self.condition.release()
+
+    def _refill(self):
+        now = time.time()
+        if self.rate is not None:
+            burst = self.rate * self.burst_seconds
+            self.tokens = min(burst, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+    def _wait_time(self):
+        if self.rate is None or self.tokens > 0:
+            # Waiting on a higher priority upload, it will notify us.
+            return 1.0
+        return max(0.01, -self.tokens / float(self.rate))
+
+
+class ThrottledFile:
+    """
+    Read only file whose reads draw from a BandwidthLimiter, so that
+    uploading it (e.g. via fabric's put, which accepts file-like objects) is
+    shaped as it happens. Changes to the limiter's rate apply to uploads
+    already in progress.
+    """
+
+    def __init__(self, path, priority=NORMAL_PRIORITY, limiter=None):
+        self.file = open(path, "rb")
+        self.priority = priority
+        self.limiter = limiter or bandwidth_limiter
+
+    def read(self, size=-1):
+        data = self.file.read(size)
+        if data:
+            self.limiter.acquire(len(data), self.priority)
+        return data
+
+    def seek(self, offset, whence=0):
+        self.file.seek(offset, whence)
+
+    def tell(self):
+        return self.file.tell()
+
+    def close(self):
+        self.file.close()
+
+
+bandwidth_limiter = BandwidthLimiter()
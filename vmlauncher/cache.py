@@ -0,0 +1,149 @@
+import os
+import json
+import time
+import hashlib
+
+from threading import Lock
+
+DEFAULT_TOKEN_STORE_PATH = os.path.join("~", ".vmlauncher", "auth_tokens.json")
+# Treat tokens this close to expiring as already expired, so a token does not
+# lapse part way through a launch.
+TOKEN_EXPIRY_MARGIN = 300
+
+
+class ConnectionCache:
+    """
+    Process wide cache of driver connections, so launcher instances built for
+    the same provider section reuse one authenticated connection.
+    """
+
+    def __init__(self):
+        self.connections = {}
+        self.lock = Lock()
+
+    def get(self, key, factory):
+        self.lock.acquire()
+        try:
+            if key not in self.connections:
+                self.connections[key] = factory()
+            return self.connections[key]
+        finally:
+            self.lock.release()
+
+    def clear(self):
+        self.lock.acquire()
+        try:
+            self.connections.clear()
+        finally:
+            self.lock.release()
+
+
+class TokenStore:
+    """
+    Persists provider auth tokens between invocations in a JSON file readable
+    only by the current user. Entries are keyed on the provider section and
+    carry a digest of the credentials they were issued for, so changing a
+    section's credentials invalidates its cached token.
+    """
+
+    def __init__(self, path=None):
+        if not path:
+            path = DEFAULT_TOKEN_STORE_PATH
+        self.path = os.path.expanduser(path)
+        self.lock = Lock()
+
+    def get(self, section, identity):
+        self.lock.acquire()
+        try:
+            entry = self._read().get(section)
+        finally:
+            self.lock.release()
+        if not entry or entry.get("identity") != identity_digest(identity):
+            return None
+        if entry.get("expires", 0) < time.time() + TOKEN_EXPIRY_MARGIN:
+            return None
+        return entry
+
+    def put(self, section, identity, token, expires, base_url):
+        self.lock.acquire()
+        try:
+            entries = self._read()
+            entries[section] = {"identity": identity_digest(identity),
+                                "token": token,
+                                "expires": expires,
+                                "base_url": base_url}
+            self._write(entries)
+        finally:
+            self.lock.release()
+
+    def remove(self, section):
+        self.lock.acquire()
+        try:
+            entries = self._read()
+            if section in entries:
+                del entries[section]
+                self._write(entries)
+        finally:
+            self.lock.release()
+
+    def _read(self):
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            return json.load(open(self.path, "r"))
+        except ValueError:
+            # Corrupt store, just reauthenticate.
+            return {}
+
+    def _write(self, entries):
+        directory = os.path.dirname(self.path)
+        if not os.path.exists(directory):
+            os.makedirs(directory, 0700)
+        temp_path = "%s.%d.tmp" % (self.path, os.getpid())
+        fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0600)
+        output = os.fdopen(fd, "w")
+        try:
+            json.dump(entries, output)
+        finally:
+            output.close()
+        os.rename(temp_path, self.path)
+
+
+class TokenFallbackConnection:
+    """
+    Proxy for a driver created with a cached auth token. If the provider
+    rejects the token (e.g. it was revoked), the call is retried once on a
+    driver built by reauthenticate, which is used from then on.
+    """
+
+    def __init__(self, conn, reauthenticate):
+        self.__dict__["_conn"] = conn
+        self.__dict__["_reauthenticate"] = reauthenticate
+        self.__dict__["_reauthenticated"] = False
+
+    def __getattr__(self, name):
+        value = getattr(self._conn, name)
+        if not callable(value) or self._reauthenticated:
+            return value
+
+        def call(*args, **kwds):
+            from libcloud.common.types import InvalidCredsError
+            try:
+                return value(*args, **kwds)
+            except InvalidCredsError:
+                if self._reauthenticated:
+                    raise
+                self.__dict__["_conn"] = self._reauthenticate()
+                self.__dict__["_reauthenticated"] = True
+                return getattr(self._conn, name)(*args, **kwds)
+        return call
+
+    def __setattr__(self, name, value):
+        setattr(self._conn, name, value)
+
+
+def identity_digest(identity):
+    return hashlib.sha1(json.dumps(identity, sort_keys=True)).hexdigest()
+
+
+connection_cache = ConnectionCache()
@@ -0,0 +1,134 @@
+"""
+Reassemble a file from the chunks produced by FileSplitter.
+
+This script is copied to and run on the remote host by FileTransferManager,
+so it must only depend on the standard library and run on both Python 2 and
+Python 3. Each chunk is an independent (optionally gzipped) piece of the
+original file, so chunks are decompressed by a pool of worker processes and
+written directly at their offset in a preallocated destination file. Each
+part is deleted as soon as it has been consumed, keeping peak disk usage close
+to the size of the final file.
+
+Usage:
+    reassemble.py [--gunzip] [--checksums] [--jobs N] SIZE CHUNK_SIZE DESTINATION PART...
+
+With --checksums, a SHA-256 checksum line ("<checksum>  <chunk index>") is
+printed for the decompressed contents of each chunk.
+"""
+import os
+import re
+import sys
+import zlib
+import hashlib
+import optparse
+import multiprocessing
+
+BLOCK_SIZE = 1024 * 1024
+PART_INDEX_PATTERN = re.compile(r"_part(\d+)(\.gz)?$")
+
+
+def part_index(part):
+    match = PART_INDEX_PATTERN.search(part)
+    if not match:
+        raise Exception("Cannot determine chunk index of %s" % part)
+    return int(match.group(1))
+
+
+def write_at(fd, data, offset):
+    if hasattr(os, "pwrite"):
+        while data:
+            written = os.pwrite(fd, data, offset)
+            data = data[written:]
+            offset += written
+    else:
+        # Each worker process has its own descriptor, so seek and write is safe.
+        os.lseek(fd, offset, os.SEEK_SET)
+        while data:
+            written = os.write(fd, data)
+            data = data[written:]
+
+
+def reassemble_part(args):
+    destination, part, offset, expected_size, gunzip = args
+    checksum = hashlib.sha256()
+    written = 0
+    fd = os.open(destination, os.O_WRONLY)
+    input = open(part, "rb")
+    try:
+        if gunzip:
+            decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        while True:
+            block = input.read(BLOCK_SIZE)
+            if not block:
+                break
+            if gunzip:
+                block = decompressor.decompress(block)
+            if block:
+                write_at(fd, block, offset + written)
+                checksum.update(block)
+                written += len(block)
+        if gunzip:
+            block = decompressor.flush()
+            if block:
+                write_at(fd, block, offset + written)
+                checksum.update(block)
+                written += len(block)
+    finally:
+        input.close()
+        os.close(fd)
+    if written != expected_size:
+        raise Exception("Chunk %s contained %d bytes, expected %d" % (part, written, expected_size))
+    os.remove(part)
+    return part_index(part), checksum.hexdigest()
+
+
+def preallocate(destination, size):
+    fd = os.open(destination, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, int("644", 8))
+    try:
+        if size and hasattr(os, "posix_fallocate"):
+            os.posix_fallocate(fd, 0, size)
+        else:
+            os.ftruncate(fd, size)
+    finally:
+        os.close(fd)
+
+
+def main(argv=None):
+    parser = optparse.OptionParser(usage="%prog [options] SIZE CHUNK_SIZE DESTINATION PART...")
+    parser.add_option("--gunzip", action="store_true", default=False)
+    parser.add_option("--checksums", action="store_true", default=False)
+    parser.add_option("--jobs", type="int", default=multiprocessing.cpu_count())
+    (options, args) = parser.parse_args(argv)
+    if len(args) < 3:
+        parser.error("SIZE, CHUNK_SIZE and DESTINATION are required")
+    size = int(args[0])
+    chunk_size = int(args[1])
+    destination = args[2]
+    # A shell passes a glob matching nothing through unexpanded, which is
+    # how an empty file (split into no parts) arrives.
+    parts = [part for part in args[3:] if not (part.endswith("*") and not os.path.exists(part))]
+    expected_parts = (size + chunk_size - 1) // chunk_size
+    if len(parts) != expected_parts:
+        raise Exception("Found %d part(s) for %s, expected %d" % (len(parts), destination, expected_parts))
+
+    preallocate(destination, size)
+    work = []
+    for part in parts:
+        offset = part_index(part) * chunk_size
+        work.append((destination, part, offset, min(chunk_size, size - offset), options.gunzip))
+
+    results = []
+    if work:
+        pool = multiprocessing.Pool(max(1, min(options.jobs, len(work))))
+        try:
+            results = pool.map(reassemble_part, work)
+        finally:
+            pool.close()
+            pool.join()
+    if options.checksums:
+        for index, checksum in sorted(results):
+            sys.stdout.write("%s  %d\n" % (checksum, index))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+import os
+import json
+import time
+
+from threading import Lock, local, current_thread
+
+
+class Tracer:
+    """
+    Records nested, timed spans and counters over a launch. Traces can be
+    written as Chrome trace event JSON (loadable in chrome://tracing or
+    Perfetto) or summarized as a plain text table.
+
+    If path is set, the trace is rewritten there each time an outermost span
+    finishes.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.events = []
+        self.counters = {}
+        self.lock = Lock()
+        self.local = local()
+        self.pid = os.getpid()
+
+    def span(self, name, category="launch", **args):
+        return _Span(self, name, category, args)
+
+    def wrap(self, name, func, category="launch"):
+        def traced(*args, **kwds):
+            with self.span(name, category):
+                return func(*args, **kwds)
+        return traced
+
+    def trace_connection(self, conn):
+        return TracedConnection(conn, self)
+
+    def count(self, name, amount=1):
+        self.lock.acquire()
+        try:
+            self.counters[name] = self.counters.get(name, 0) + amount
+        finally:
+            self.lock.release()
+
+    def _record(self, name, category, start, end, args):
+        event = {"name": name,
+                 "cat": category,
+                 "ph": "X",
+                 "ts": int(start * 1000000),
+                 "dur": int((end - start) * 1000000),
+                 "pid": self.pid,
+                 "tid": current_thread().ident,
+                 "args": args}
+        self.lock.acquire()
+        try:
+            self.events.append(event)
+        finally:
+            self.lock.release()
+
+    def to_chrome_trace(self):
+        self.lock.acquire()
+        try:
+            events = list(self.events)
+            counters = dict(self.counters)
+        finally:
+            self.lock.release()
+        return {"traceEvents": events,
+                "displayTimeUnit": "ms",
+                "otherData": counters}
+
+    def write(self, path=None):
+        path = path or self.path
+        if not path:
+            raise Exception("No path given to write trace to and trace_file option not set.")
+        output = open(path, "w")
+        try:
+            json.dump(self.to_chrome_trace(), output, indent=1)
+        finally:
+            output.close()
+
+    def summary(self):
+        trace = self.to_chrome_trace()
+        stats = {}
+        order = []
+        for event in trace["traceEvents"]:
+            key = (event["cat"], event["name"])
+            if key not in stats:
+                stats[key] = []
+                order.append(key)
+            stats[key].append(event["dur"] / 1000000.0)
+        lines = ["%-8s %-32s %6s %10s %10s %10s" % ("category", "span", "count", "total (s)", "mean (s)", "max (s)")]
+        for key in order:
+            durations = stats[key]
+            lines.append("%-8s %-32s %6d %10.2f %10.2f %10.2f" %
+                         (key[0], key[1], len(durations), sum(durations),
+                          sum(durations) / len(durations), max(durations)))
+        for name in sorted(trace["otherData"]):
+            lines.append("%-8s %-32s %6d" % ("counter", name, trace["otherData"][name]))
+        return "\n".join(lines)
+
+
+class _Span:
+
+    def __init__(self, tracer, name, category, args):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __enter__(self):
+        self.tracer.local.depth = getattr(self.tracer.local, "depth", 0) + 1
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        end = time.time()
+        if exc_type:
+            self.args["error"] = str(exc_value)
+        self.tracer._record(self.name, self.category, self.start, end, self.args)
+        self.tracer.local.depth -= 1
+        if self.tracer.local.depth == 0 and self.tracer.path:
+            self.tracer.write()
+        return False
+
+
+class NullTracer:
+    """Tracer used when tracing is disabled, records nothing."""
+
+    path = None
+
+    def span(self, name, category="launch", **args):
+        return _NullSpan()
+
+    def wrap(self, name, func, category="launch"):
+        return func
+
+    def trace_connection(self, conn):
+        return conn
+
+    def count(self, name, amount=1):
+        pass
+
+    def write(self, path=None):
+        raise Exception("Tracing not enabled, set the trace or trace_file option.")
+
+    def summary(self):
+        return "Tracing not enabled."
+
+
+class _NullSpan:
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+class TracedConnection:
+    """
+    Proxy for a libcloud driver (or VagrantConnection) recording a span and a
+    call count for every public method called on it. Underscore prefixed
+    methods (e.g. _ssh_client_connect) are internal rather than provider API
+    calls and are passed through untraced.
+    """
+
+    def __init__(self, conn, tracer):
+        self.__dict__["_conn"] = conn
+        self.__dict__["_tracer"] = tracer
+
+    def __getattr__(self, name):
+        value = getattr(self._conn, name)
+        if not callable(value) or name.startswith("_"):
+            return value
+        tracer = self._tracer
+
+        def traced(*args, **kwds):
+            tracer.count("api_calls:%s" % name)
+            with tracer.span(name, "api"):
+                return value(*args, **kwds)
+        return traced
+
+    def __setattr__(self, name, value):
+        setattr(self._conn, name, value)
+
+
+def build_tracer(options):
+    """
+    Build a Tracer if the ``trace`` or ``trace_file`` option is set,
+    otherwise a NullTracer.
+    """
+    trace_file = options.get("trace_file", None)
+    if trace_file:
+        return Tracer(os.path.expanduser(trace_file))
+    if options.get("trace", False):
+        return Tracer()
+    return NullTracer()
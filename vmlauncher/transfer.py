@@ -1,15 +1,26 @@
 import os
 import gzip
+import random
+import hashlib
 
 from operator import itemgetter
-from sys import exit
 from threading import Thread
 from threading import Condition
+from threading import Lock
+from threading import Timer
 from Queue import Queue
 
-from fabric.api import local, put, sudo, cd
+from fabric.api import local
 from fabric.colors import red
 
+from vmlauncher.transport import SshTransport
+from vmlauncher.bandwidth import bandwidth_limiter, NORMAL_PRIORITY
+
+# Size of the blocks files are streamed through while being hashed.
+HASH_BLOCK_SIZE = 1024 * 1024
+# Standalone script run remotely to reassemble chunked files in parallel.
+REASSEMBLER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "reassemble.py")
+REMOTE_REASSEMBLER = "/tmp/vmlauncher_reassemble.py"
 
 
 class FileSplitter:
@@ -34,6 +45,7 @@ class FileSplitter:
         if compress:
             suffix = '.gz'
 
+        file_checksum = hashlib.sha256()
         input = open(path, 'rb')
         while True:
             chunk_name = "%s_part%08d%s" % (basename, chunk_num, suffix)
@@ -44,6 +56,10 @@ class FileSplitter:
 
             chunk = input.read(this_chunk_size)
             total_bytes += len(chunk)
+            # Checksums are computed from the bytes already read for
+            # splitting, so verification costs no additional local read.
+            file_checksum.update(chunk)
+            transfer_target.chunk_checksums[chunk_num] = hashlib.sha256(chunk).hexdigest()
             if compress:
                 chunk_output = gzip.open(chunk_path, 'wb')
             else:
@@ -53,22 +69,40 @@ class FileSplitter:
 
             self.chunk_callback.handle_chunk(chunk_path, transfer_target)
             chunk_num += 1
+        input.close()
+        transfer_target.checksum = file_checksum.hexdigest()
+        transfer_target.file_size = total_bytes
 
 
 class TransferTarget:
 
-    def __init__(self, file, precompressed, transfer_manager):
+    def __init__(self, file, precompressed, transfer_manager, priority=NORMAL_PRIORITY):
         self.file = file
+        self.priority = priority
         self.precompressed = precompressed
         self.do_compress = transfer_manager.compress
         self.do_split = transfer_manager.chunk_size > 0
         self.local_temp = transfer_manager.local_temp
+        self.verify = transfer_manager.verify_checksums
+        self.checksum = None
+        self.chunk_checksums = {}
+        self.file_size = None
+        self.errors = []
+        self.retries = 0
+        self.artifact_key = None
+        self.from_artifact_store = False
         basename = os.path.basename(file)
         if len(basename) < 1:
-            print red(Exception("Invalid file specified - %s" % file))
-            exit(-1)
+            raise Exception("Invalid file specified - %s" % file)
         self.basename = basename
 
+    def fail(self, message):
+        print red(message)
+        self.errors.append(message)
+
+    def failed(self):
+        return len(self.errors) > 0
+
     def should_compress(self):
         return not self.precompressed and self.do_compress
 
@@ -94,6 +128,12 @@ class TransferTarget:
             decompressed_basename = basename
         return decompressed_basename
 
+    def final_basename(self):
+        if self.precompressed:
+            return self.decompressed_basename()
+        else:
+            return self.basename
+
     def compressed_file(self):
         compressed_file = "%s/%s.gz" % (self.local_temp, self.basename)
         return compressed_file
@@ -101,17 +141,53 @@ class TransferTarget:
     def build_simple_chunk(self):
         if self.should_compress():
             compressed_file = self.compressed_file()
-            local("gzip -f -9 '%s' -c > '%s'" % (self.file, compressed_file))
+            self.checksum = hash_file(self.file, gzip.open(compressed_file, 'wb', 9))
             return TransferChunk(compressed_file, self)
         else:
+            if self.verify and not self.checksum:
+                self.checksum = hash_file(self.file)
             return TransferChunk(self.file, self)
 
 
+def set_bandwidth_limit(limit):
+    """
+    Cap the combined upload rate of all transfers in this process at limit
+    KB/s (None for no limit), takes effect for uploads already queued.
+    """
+    if limit:
+        bandwidth_limiter.set_rate(limit * 1024)
+    else:
+        bandwidth_limiter.set_rate(None)
+
+
+def hash_file(path, output=None):
+    """
+    Compute the SHA-256 checksum of the file at path, copying its contents to
+    output (e.g. a gzip file) in the same pass if supplied.
+    """
+    checksum = hashlib.sha256()
+    input = open(path, 'rb')
+    try:
+        while True:
+            block = input.read(HASH_BLOCK_SIZE)
+            if not block:
+                break
+            checksum.update(block)
+            if output:
+                output.write(block)
+    finally:
+        input.close()
+        if output:
+            output.close()
+    return checksum.hexdigest()
+
+
 class TransferChunk:
 
     def __init__(self, chunk_path, transfer_target):
         self.chunk_path = chunk_path
         self.transfer_target = transfer_target
+        self.attempts = 0
 
     def clean_up(self):
         was_split = self.transfer_target.split_up()
@@ -120,6 +196,44 @@ class TransferChunk:
             local("rm '%s'" % self.chunk_path)
 
 
+class TransferException(Exception):
+    """Raised by transfer_files when some files could not be transferred."""
+
+    def __init__(self, summary):
+        Exception.__init__(self, "Failed to transfer %d file(s):\n%s" % (len(summary.failed()), summary))
+        self.summary = summary
+
+
+class TransferSummary:
+    """Outcome of each file passed to FileTransferManager.transfer_files."""
+
+    def __init__(self, transfer_targets):
+        self.transfer_targets = transfer_targets
+
+    def bytes_avoided(self):
+        """Bytes not uploaded because files were found in the artifact store."""
+        return sum([os.path.getsize(target.file) for target in self.transfer_targets if target.from_artifact_store])
+
+    def succeeded(self):
+        return [target for target in self.transfer_targets if not target.failed()]
+
+    def failed(self):
+        return [target for target in self.transfer_targets if target.failed()]
+
+    def __str__(self):
+        lines = []
+        for target in self.transfer_targets:
+            if target.failed():
+                status = "failed (%s)" % "; ".join(target.errors)
+            elif target.from_artifact_store:
+                status = "ok (from artifact store)"
+            else:
+                status = "ok"
+            lines.append("%s: %s, %d retries" % (target.file, status, target.retries))
+        lines.append("%d bytes avoided via artifact store" % self.bytes_avoided())
+        return "\n".join(lines)
+
+
 class FileTransferManager:
 
     def __init__(self,
@@ -129,47 +243,86 @@ class FileTransferManager:
                  num_decompress_threads=1,
                  chunk_size=0,
                  transfer_retries=3,
+                 max_run_retries=None,
+                 retry_delay=1.0,
+                 max_retry_delay=60.0,
                  destination="/tmp",
                  transfer_as="root",
-                 local_temp=None):
+                 local_temp=None,
+                 verify_checksums=False,
+                 parallel_reassembly=True,
+                 transport=None,
+                 bandwidth_limit=None,
+                 artifact_store=None):
+        if not transport:
+            transport = SshTransport()
+        if transport.skip_compression:
+            compress = False
+            chunk_size = 0
+        self.transport = transport
+        self.artifact_store = artifact_store
         self.compress = compress
         self.num_compress_threads = num_compress_threads
         self.num_transfer_threads = num_transfer_threads
         self.num_decompress_threads = num_decompress_threads
         self.chunk_size = chunk_size
         self.transfer_retries = transfer_retries
+        self.max_run_retries = max_run_retries
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
         self.destination = destination
         self.transfer_as = transfer_as
         self.local_temp = local_temp
+        self.verify_checksums = verify_checksums
+        self.parallel_reassembly = parallel_reassembly
+        self.reassembler_deployed = False
+        self.reassembler_lock = Lock()
 
         if not self.local_temp:
             self.local_temp = "/tmp"
 
+        if bandwidth_limit:
+            # Limit is shared by all transfer managers in this process.
+            set_bandwidth_limit(bandwidth_limit)
+
         local("mkdir -p '%s'" % self.local_temp)
         self.file_splitter = FileSplitter(self.chunk_size, self.local_temp, self)
 
     def handle_chunk(self, chunk, transfer_target):
         self._enqueue_chunk(TransferChunk(chunk, transfer_target))
 
-    def transfer_files(self, files=[], compressed_files=[]):
+    def transfer_files(self, files=[], compressed_files=[], priorities={}, raise_on_failure=True):
+        """
+        Transfer files, returning a TransferSummary. Failed uploads are
+        retried with backoff while other chunks continue. If any file still
+        fails, a TransferException carrying the summary is raised unless
+        raise_on_failure is False.
+        """
         self.transfer_complete = False
         self.transfer_complete_condition = Condition()
+        self.run_retries = 0
+        self.run_retries_lock = Lock()
 
         self._setup_destination_directory()
 
         self._setup_workers()
 
-        self._enqueue_files(files, compressed_files)
+        transfer_targets = self._enqueue_files(files, compressed_files, priorities)
 
         self._wait_for_completion()
 
+        summary = TransferSummary(transfer_targets)
+        if raise_on_failure and summary.failed():
+            raise TransferException(summary)
+        return summary
+
     def _setup_workers(self):
         self._setup_compress_threads()
         self._setup_transfer_threads()
         self._setup_decompress_threads()
 
     def _setup_destination_directory(self):
-        sudo("mkdir -p %s" % self.destination)
+        self.transport.run("mkdir -p %s" % self.destination)
         self._chown(self.destination)
 
     def _setup_compress_threads(self):
@@ -190,20 +343,21 @@ class FileTransferManager:
             t.daemon = True
             t.start()
 
-    def _enqueue_files(self, files, compressed_files):
+    def _enqueue_files(self, files, compressed_files, priorities):
         transfer_targets = []
 
         for file in files:
-            transfer_target = TransferTarget(file, False, self)
+            transfer_target = TransferTarget(file, False, self, priorities.get(file, NORMAL_PRIORITY))
             transfer_targets.append(transfer_target)
 
         for compressed_file in compressed_files:
-            transfer_target = TransferTarget(compressed_file, True, self)
+            transfer_target = TransferTarget(compressed_file, True, self, priorities.get(compressed_file, NORMAL_PRIORITY))
             transfer_targets.append(transfer_target)
 
         transfer_targets = self._sort_transfer_targets(transfer_targets)
         for transfer_target in transfer_targets:
             self.compress_queue.put(transfer_target)
+        return transfer_targets
 
     def _sort_transfer_targets(self, transfer_targets):
         for i in range(len(transfer_targets)):
@@ -226,6 +380,8 @@ class FileTransferManager:
             try:
                 transfer_target = self.compress_queue.get()
                 file = transfer_target.file
+                if self.artifact_store and self._materialize_artifact(transfer_target):
+                    continue
                 if self.chunk_size > 0:
                     should_compress = transfer_target.should_compress()
                     self.file_splitter.split_file(file, should_compress, transfer_target)
@@ -233,9 +389,8 @@ class FileTransferManager:
                 else:
                     simple_chunk = transfer_target.build_simple_chunk()
                     self._enqueue_chunk(simple_chunk)
-            except Exception as e:
-                print red("Failed to compress a file to transfer")
-                print red(e)
+            except BaseException as e:
+                transfer_target.fail("Failed to compress a file to transfer - %s" % e)
             finally:
                 self.compress_queue.task_done()
 
@@ -248,67 +403,199 @@ class FileTransferManager:
         while True:
             try:
                 transfer_target = self.decompress_queue.get()
+                if transfer_target.failed():
+                    # Some chunk never made it, nothing to reassemble.
+                    continue
                 basename = transfer_target.basename
                 chunked = transfer_target.split_up()
                 compressed = transfer_target.do_compress or transfer_target.precompressed
-                with cd(self.destination):
-                    if compressed and chunked:
-                        destination = transfer_target.decompressed_basename()
-                        if transfer_target.precompressed:
-                            sudo("cat '%s_part'* | gunzip -c > %s" % (basename, destination), user=self.transfer_as)
-                        else:
-                            sudo("zcat '%s_part'* > %s" % (basename, destination), user=self.transfer_as)
-                        sudo("rm '%s_part'*" % (basename), user=self.transfer_as)
-                    elif compressed:
-                        sudo("gunzip -f '%s'" % transfer_target.compressed_basename(), user=self.transfer_as)
-                    elif chunked:
-                        sudo("cat '%s'_part* > '%s'" % (basename, basename), user=self.transfer_as)
-                        sudo("rm '%s_part'*" % (basename), user=self.transfer_as)
-            except Exception as e:
-                print red("Failed to decompress or unsplit a transfered file.")
-                print red(e)
+                if chunked and transfer_target.file_size == 0:
+                    # An empty file is split into no parts, just create it.
+                    self._run(": > '%s'" % transfer_target.final_basename())
+                    if transfer_target.artifact_key:
+                        self._populate_artifact(transfer_target)
+                    continue
+                if transfer_target.verify and transfer_target.precompressed:
+                    # Payload is only known compressed, check the parts as uploaded.
+                    self._verify_uploaded(transfer_target)
+                parallel = chunked and not transfer_target.precompressed and self.parallel_reassembly
+                if parallel:
+                    # Chunks are independent, reassemble them in parallel
+                    # (verifying checksums along the way).
+                    self._reassemble(transfer_target, compressed)
+                elif compressed and chunked:
+                    destination = transfer_target.final_basename()
+                    if transfer_target.precompressed:
+                        self._run("cat '%s_part'* | gunzip -c > %s" % (basename, destination))
+                    else:
+                        self._run("zcat '%s_part'* > %s" % (basename, destination))
+                    self._run("rm '%s_part'*" % (basename))
+                elif compressed:
+                    self._run("gunzip -f '%s'" % transfer_target.compressed_basename())
+                elif chunked:
+                    self._run("cat '%s'_part* > '%s'" % (basename, basename))
+                    self._run("rm '%s_part'*" % (basename))
+                if transfer_target.verify and not transfer_target.precompressed and not parallel:
+                    self._verify_reassembled(transfer_target)
+                if transfer_target.artifact_key:
+                    self._populate_artifact(transfer_target)
+            except BaseException as e:
+                transfer_target.fail("Failed to decompress or unsplit a transfered file - %s" % e)
             finally:
                 self.decompress_queue.task_done()
 
+    def _materialize_artifact(self, transfer_target):
+        """
+        Copy the target into place from the artifact store if present there,
+        otherwise note its key so the store is populated once it has been
+        transferred.
+        """
+        digest = hash_file(transfer_target.file)
+        transfer_target.checksum = digest
+        key = digest
+        if transfer_target.precompressed:
+            # Stored decompressed, keep distinct from the raw file's entry.
+            key = "%s-gunzipped" % digest
+        if self.artifact_store.contains(key, self._run):
+            self.artifact_store.materialize(key, transfer_target.final_basename(), self._run)
+            transfer_target.from_artifact_store = True
+            return True
+        transfer_target.artifact_key = key
+        return False
+
+    def _populate_artifact(self, transfer_target):
+        try:
+            self.artifact_store.populate(transfer_target.artifact_key, transfer_target.final_basename(), self._run)
+        except BaseException as e:
+            # The file itself was transferred, a cold store is not a failure.
+            print red("Failed to add %s to the artifact store - %s" % (transfer_target.file, e))
+
+    def _reassemble(self, transfer_target, compressed):
+        self._deploy_reassembler()
+        flags = []
+        if compressed:
+            flags.append("--gunzip")
+        if transfer_target.verify:
+            flags.append("--checksums")
+        command = "$(command -v python3 || command -v python) %s %s %d %d '%s' '%s_part'*" % \
+            (REMOTE_REASSEMBLER, " ".join(flags), transfer_target.file_size,
+             self.chunk_size * 1024 * 1024, transfer_target.final_basename(), transfer_target.basename)
+        output = self._run(command)
+        if transfer_target.verify:
+            actual = self._parse_checksums(output, lambda name: int(name))
+            self._check_checksums(transfer_target.final_basename(), transfer_target.chunk_checksums, actual)
+
+    def _deploy_reassembler(self):
+        self.reassembler_lock.acquire()
+        try:
+            if not self.reassembler_deployed:
+                self.transport.put(REASSEMBLER_PATH, REMOTE_REASSEMBLER)
+                self.transport.run("chmod 755 %s" % REMOTE_REASSEMBLER)
+                self.reassembler_deployed = True
+        finally:
+            self.reassembler_lock.release()
+
+    def _verify_reassembled(self, transfer_target):
+        path = transfer_target.final_basename()
+        if transfer_target.split_up():
+            # Checksum each chunk sized range of the reassembled file in
+            # parallel on the remote host.
+            chunk_size = self.chunk_size
+            num_chunks = len(transfer_target.chunk_checksums)
+            offsets = " ".join(["%d %d" % (index, index * chunk_size) for index in range(num_chunks)])
+            command = ("echo %s | xargs -n 2 -P $(nproc) sh -c "
+                       "'dd if=\"%s\" bs=1048576 skip=$1 count=%d 2>/dev/null | sha256sum | sed \"s/-$/$0/\"'")
+            output = self._run(command % (offsets, path, chunk_size))
+            actual = self._parse_checksums(output, lambda name: int(name))
+            self._check_checksums(path, transfer_target.chunk_checksums, actual)
+        else:
+            output = self._run("sha256sum '%s'" % path)
+            self._check_checksums(path, {0: transfer_target.checksum}, {0: output.split()[0]})
+
+    def _verify_uploaded(self, transfer_target):
+        basename = transfer_target.basename
+        if transfer_target.split_up():
+            output = self._run("ls '%s_part'* | xargs -P $(nproc) -n 1 sha256sum" % basename)
+            actual = self._parse_checksums(output, lambda name: int(name[-len("00000000"):]))
+            self._check_checksums(basename, transfer_target.chunk_checksums, actual)
+        else:
+            output = self._run("sha256sum '%s'" % basename)
+            self._check_checksums(basename, {0: transfer_target.checksum}, {0: output.split()[0]})
+
+    def _parse_checksums(self, output, index_from_name):
+        checksums = {}
+        for line in output.splitlines():
+            if not line.strip():
+                continue
+            checksum, name = line.split()
+            checksums[index_from_name(name)] = checksum
+        return checksums
+
+    def _check_checksums(self, path, expected, actual):
+        mismatched = [index for index in expected if expected[index] != actual.get(index)]
+        if mismatched:
+            raise Exception("Checksum mismatch for %s in chunk(s) %s" % (path, ", ".join(map(str, sorted(mismatched)))))
+
     def _put_files(self):
         while True:
+            transfer_chunk = self.transfer_queue.get()
+            transfer_target = transfer_chunk.transfer_target
+            compressed_file = transfer_chunk.chunk_path
+            basename = os.path.basename(compressed_file)
+            if transfer_target.failed():
+                # Another chunk of this file already failed for good.
+                transfer_chunk.clean_up()
+                self.transfer_queue.task_done()
+                continue
             try:
-                transfer_chunk = self.transfer_queue.get()
-                transfer_target = transfer_chunk.transfer_target
-                compressed_file = transfer_chunk.chunk_path
-                basename = os.path.basename(compressed_file)
-                self._put_as_user(compressed_file, "%s/%s" % (self.destination, basename))
+                self._put_as_user(compressed_file, "%s/%s" % (self.destination, basename), transfer_target.priority)
+            except BaseException as e:
+                transfer_chunk.attempts += 1
+                print red("Failed to upload %s on attempt %d - %s" % (compressed_file, transfer_chunk.attempts, e))
+                if transfer_chunk.attempts < self.transfer_retries and self._take_run_retry():
+                    # Leave the task open until the chunk is requeued so
+                    # _wait_for_completion keeps waiting on it.
+                    transfer_target.retries += 1
+                    self._schedule_retry(transfer_chunk)
+                    continue
+                transfer_target.fail("Failed to transfer %s after %d attempt(s) - %s" % (compressed_file, transfer_chunk.attempts, e))
+            else:
                 if not transfer_target.split_up():
                     self.decompress_queue.put(transfer_target)
-            except Exception as e:
-                print red("Failed to upload a file.")
-                print red(e)
-            finally:
-                transfer_chunk.clean_up()
-                self.transfer_queue.task_done()
+            transfer_chunk.clean_up()
+            self.transfer_queue.task_done()
+
+    def _take_run_retry(self):
+        self.run_retries_lock.acquire()
+        try:
+            if self.max_run_retries is not None and self.run_retries >= self.max_run_retries:
+                return False
+            self.run_retries += 1
+            return True
+        finally:
+            self.run_retries_lock.release()
+
+    def _schedule_retry(self, transfer_chunk):
+        delay = min(self.max_retry_delay, self.retry_delay * (2 ** (transfer_chunk.attempts - 1)))
+        # Jitter so chunks failing together (e.g. on a network blip) do not
+        # all retry at the same instant.
+        delay = random.uniform(delay / 2, delay)
+        timer = Timer(delay, self._requeue_chunk, [transfer_chunk])
+        timer.daemon = True
+        timer.start()
+
+    def _requeue_chunk(self, transfer_chunk):
+        self.transfer_queue.put(transfer_chunk)
+        self.transfer_queue.task_done()
 
     def _chown(self, destination):
-        sudo("chown %s:%s '%s'" % (self.transfer_as, self.transfer_as, destination))
+        self.transport.chown(destination, self.transfer_as)
 
-    def _put_as_user(self, source, destination):
-        for attempt in range(self.transfer_retries):
-            retry = False
-            try:
-                put(source, destination, use_sudo=True)
-                self._chown(destination)
-            except BaseException as e:
-                retry = True
-                print red(e)
-                print red("Failed to upload %s on attempt %d" % (source, attempt + 1))
-            except:
-                # Should never get here, delete this block when more confident
-                retry = True
-                print red("Failed to upload %s on attempt %d" % (source, attempt + 1))
-            finally:
-                if not retry:
-                    return
-        print red("Failed to transfer file %s, exiting..." % source)
-        exit(-1)
+    def _run(self, command):
+        return self.transport.run(command, user=self.transfer_as, cwd=self.destination)
+
+    def _put_as_user(self, source, destination, priority=NORMAL_PRIORITY):
+        self.transport.put(source, destination, owner=self.transfer_as, priority=priority)
 
     def _enqueue_chunk(self, transfer_chunk):
         self.transfer_queue.put(transfer_chunk)
@@ -0,0 +1,96 @@
+import os
+import shutil
+import tempfile
+
+from fabric.api import local, put, sudo, cd
+
+from vmlauncher.bandwidth import ThrottledFile, NORMAL_PRIORITY
+
+
+class SshTransport:
+    """
+    Uploads files to and runs commands on the current fabric host over SSH.
+    """
+    # Transports that do not cross a network have nothing to gain from
+    # compressing or splitting files.
+    skip_compression = False
+
+    def put(self, source, destination, owner=None, priority=NORMAL_PRIORITY):
+        # Upload through a throttled reader so the shared bandwidth limit
+        # applies while the file is being sent.
+        throttled_source = ThrottledFile(source, priority)
+        try:
+            put(throttled_source, destination, use_sudo=True)
+        finally:
+            throttled_source.close()
+        if owner:
+            self.chown(destination, owner)
+
+    def run(self, command, user=None, cwd=None):
+        if cwd:
+            with cd(cwd):
+                return sudo(command, user=user)
+        return sudo(command, user=user)
+
+    def chown(self, path, owner):
+        sudo("chown %s:%s '%s'" % (owner, owner, path))
+
+
+class SyncedFolderTransport(SshTransport):
+    """
+    Stages files through a folder shared between the host and the guest
+    (e.g. Vagrant's synced /vagrant folder). Files are hardlinked (or reflinked
+    or copied if that is not possible) into the shared folder and then moved
+    into place by the guest, so nothing is compressed or sent over SSH.
+    """
+    skip_compression = True
+
+    def __init__(self, host_folder, guest_folder):
+        self.host_folder = os.path.abspath(host_folder)
+        self.guest_folder = guest_folder
+        self.staging_folder = os.path.join(self.host_folder, ".vmlauncher_staging")
+
+    def put(self, source, destination, owner=None, priority=NORMAL_PRIORITY):
+        if not os.path.exists(self.staging_folder):
+            os.makedirs(self.staging_folder)
+        stage_dir = tempfile.mkdtemp(dir=self.staging_folder)
+        try:
+            staged_path = os.path.join(stage_dir, os.path.basename(source))
+            self._stage(source, staged_path)
+            guest_path = self._guest_path(staged_path)
+            sudo("mv '%s' '%s'" % (guest_path, destination))
+            if owner:
+                self.chown(destination, owner)
+        finally:
+            shutil.rmtree(stage_dir, ignore_errors=True)
+
+    def _stage(self, source, staged_path):
+        try:
+            os.link(source, staged_path)
+        except OSError:
+            # Different filesystem or no hardlink support, let cp use a
+            # reflink where the filesystem allows it.
+            local("cp --reflink=auto '%s' '%s'" % (source, staged_path))
+
+    def _guest_path(self, host_path):
+        relative_path = os.path.relpath(host_path, self.host_folder)
+        return "%s/%s" % (self.guest_folder.rstrip("/"), relative_path.replace(os.sep, "/"))
+
+
+class LocalTransport:
+    """
+    "Transfers" files by copying them on the local machine and runs commands
+    locally, for exercising FileTransferManager without a remote host.
+    """
+    skip_compression = False
+
+    def put(self, source, destination, owner=None, priority=NORMAL_PRIORITY):
+        shutil.copyfile(source, destination)
+
+    def run(self, command, user=None, cwd=None):
+        if cwd:
+            command = "cd '%s' && %s" % (cwd, command)
+        return local(command, capture=True)
+
+    def chown(self, path, owner):
+        pass